@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+
+# Python script to measure the performance of the library tooling
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+
+import gc
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+import subprocess
+from collections import namedtuple
+from pathlib import Path
+
+from parse import Tag, LIBRARY_ROOT, DUMP_SUFFIX, find_files
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+
+def measure_memory(files, lazy=False):
+	"""
+	Load every file into a Tag and keep them all alive, returning the number
+	of tags loaded and the memory they hold (as traced by tracemalloc) in
+	bytes per tag.  This includes each tag's raw data, but not the list
+	holding the tags.
+	"""
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+
+	tags = []
+	for file in files:
+		with open(file, "rb") as f:
+			try:
+				tags.append(Tag(file.name, f.read(), lazy=lazy))
+			except Exception:
+				continue
+
+	gc.collect()
+	used = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(tags)
+	tracemalloc.stop()
+	return len(tags), used / max(len(tags), 1)
+
+def reference_kdf(uid):
+	"""repair.kdf() as it was originally written with pycryptodome, to check the stdlib version against"""
+	from Crypto.Protocol.KDF import HKDF
+	from Crypto.Hash import SHA256
+	from repair import KDF_SALT, KDF_CONTEXTS
+	return [key for context in KDF_CONTEXTS for key in HKDF(uid, 6, KDF_SALT, SHA256, 16, context=context)]
+
+def measure_kdf(files, repeat=3):
+	"""
+	Derive the keys of every dump's UID with repair.kdf_many(), returning the
+	best rate in keys per second, the rate of the pycryptodome HKDF it
+	replaced, and whether the two agree on every key (both None if
+	pycryptodome isn't installed).
+	"""
+	from repair import kdf_many, read_dump, extract_uid
+
+	uids = []
+	for file in files:
+		try:
+			uids.append(bytes(extract_uid(read_dump(file))))
+		except (OSError, ValueError):
+			continue
+
+	def rate(derive):
+		best = float("inf")
+		for _ in range(repeat):
+			start = time.perf_counter()
+			keys = derive()
+			best = min(best, time.perf_counter() - start)
+		return sum(map(len, keys)) / best, keys
+
+	keys_per_second, keys = rate(lambda: kdf_many(uids))
+	try:
+		reference_per_second, reference = rate(lambda: [reference_kdf(uid) for uid in uids])
+	except ImportError:
+		return len(uids), keys_per_second, None, None
+	return len(uids), keys_per_second, reference_per_second, keys == reference
+
+# Import time budget of each entry point in milliseconds, and modules it must not import until they're needed
+IMPORT_BUDGETS = {
+	"parse": (20, ["argparse", "json", "numpy", "concurrent.futures", "threading", "csv"]),
+	"convert": (30, ["multiprocessing", "numpy"]),
+	"repair": (25, ["multiprocessing", "Crypto", "numpy"]),
+	"library_checker": (30, ["rich", "multiprocessing", "numpy"]),
+	"pack": (20, ["numpy"]),
+	"tag_cache": (25, ["numpy"]),
+	"export_sqlite": (30, ["numpy"]),
+	"scrape_filaments": (20, ["requests", "prettytable"]),
+	"query": (100, []),
+	"color_index": (100, []),
+}
+
+# Time budget in milliseconds of each command line run, over the startup of a bare interpreter, and modules it must not import
+# The dump given to the scripts is the first one in the library
+CLI_BUDGETS = {
+	"parse.py <dump>": (["parse.py", "{dump}"], 25, ["json", "numpy", "concurrent.futures", "threading", "csv"]),
+}
+
+def python_environment():
+	env = dict(os.environ)
+	# Without cached bytecode every run would include compiling the module
+	env.pop("PYTHONDONTWRITEBYTECODE", None)
+	return env
+
+def import_times(arguments, env):
+	"""Run Python with -X importtime, returning the cumulative import time in milliseconds of every module it imported"""
+	result = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=LIBRARY_ROOT, env=env, capture_output=True, text=True, check=True)
+	times = {}
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			continue
+		self_time, cumulative, name = line[len("import time:"):].split("|")
+		if not cumulative.strip().isdigit():
+			continue # The header line
+		times[name.strip()] = int(cumulative) / 1000
+	return times
+
+def measure_import(module, repeat=5):
+	"""
+	Import a module in a fresh interpreter with -X importtime, returning the
+	best cumulative import time in milliseconds and every module it imported.
+	"""
+	env = python_environment()
+	best = float("inf")
+	times = {}
+	for run in range(repeat + 1):
+		times = import_times(["-c", f"import {module}"], env)
+		# The first run may have had to write bytecode, so it's left out
+		if run:
+			best = min(best, times.get(module, float("inf")))
+	return best, set(times)
+
+def measure_command(arguments, repeat=5):
+	"""
+	Run Python with the given arguments in a fresh interpreter, returning the
+	best wall time in milliseconds over that of starting a bare interpreter,
+	and every module the run imported.
+	"""
+	env = python_environment()
+
+	def best_time(command):
+		best = float("inf")
+		for run in range(repeat + 1):
+			start = time.perf_counter()
+			subprocess.run([sys.executable, *command], cwd=LIBRARY_ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+			# As above, the first run is left out
+			if run:
+				best = min(best, time.perf_counter() - start)
+		return best * 1000
+
+	startup = best_time(["-c", "pass"])
+	return best_time(arguments) - startup, set(import_times(arguments, env))
+
+def unwanted_modules(imported, forbidden):
+	return sorted(name for name in imported if name.split(".")[0] in forbidden or name in forbidden)
+
+def check_imports(budgets=IMPORT_BUDGETS, cli_budgets=CLI_BUDGETS):
+	"""
+	Yield (name, milliseconds, budget, modules imported which shouldn't be) for
+	the import of each entry point, then for each command line run.
+	"""
+	for module, (budget, forbidden) in budgets.items():
+		milliseconds, imported = measure_import(module)
+		yield module, milliseconds, budget, unwanted_modules(imported, forbidden)
+
+	dump = str(next(find_files([LIBRARY_ROOT])))
+	for name, (arguments, budget, forbidden) in cli_budgets.items():
+		milliseconds, imported = measure_command([argument.format(dump=dump) for argument in arguments])
+		yield name, milliseconds, budget, unwanted_modules(imported, forbidden)
+
+# Benchmark suite
+# Each benchmark is prepared once (loading its input, which isn't timed) and then run several times, keeping the fastest run
+
+RESULTS_VERSION = 1
+DEFAULT_SAMPLE = 500 # Dumps used by the benchmarks which don't cover the whole library
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.1 # Relative change in throughput or peak memory counted as a regression
+MEMORY_NOISE_BYTES = 64 * 1024 # Peak memory differences smaller than this are never counted as a regression
+
+# run() does the work being timed and handles items units of it; setup(), if given, is called (untimed) before every run
+Benchmark = namedtuple("Benchmark", ["run", "items", "unit", "setup"], defaults=[None])
+BENCHMARKS = {}
+
+def benchmark(name):
+	"""Register a function which, given a BenchmarkContext, returns the Benchmark to time"""
+	def register(prepare):
+		BENCHMARKS[name] = prepare
+		return prepare
+	return register
+
+class BenchmarkContext():
+	"""The inputs shared by the benchmarks, loaded the first time one of them needs it"""
+
+	def __init__(self, root=LIBRARY_ROOT, sample=DEFAULT_SAMPLE, scratch=None):
+		self.root = Path(root)
+		self.library = list(find_files([self.root]))
+		# An evenly spread, stable sample of the library
+		self.files = self.library[::max(1, len(self.library) // sample)][:sample] if sample else self.library
+		self.cache = {}
+		self.scratch = tempfile.TemporaryDirectory(prefix="benchmark-", dir=scratch)
+
+	def close(self):
+		self.scratch.cleanup()
+
+	def get(self, name, load):
+		if name not in self.cache:
+			self.cache[name] = load()
+		return self.cache[name]
+
+	def contents(self, suffix):
+		"""The contents of the file with the given suffix next to each sampled dump, where there is one"""
+		def load():
+			contents = []
+			for file in self.files:
+				other = file.with_name(file.name[:-len(DUMP_SUFFIX)] + suffix)
+				if other.exists():
+					contents.append((other.name, other.read_bytes()))
+			return contents
+		return self.get(suffix, load)
+
+	@property
+	def tags(self):
+		return self.get("tags", lambda: [Tag(name, data) for name, data in self.contents(DUMP_SUFFIX)])
+
+	def copy_directories(self, name):
+		"""Copy the directory of every sampled dump into a new scratch directory, returning the copies"""
+		directories = []
+		for i, directory in enumerate(sorted({file.parent for file in self.files})):
+			copy = Path(self.scratch.name) / name / str(i)
+			shutil.copytree(directory, copy)
+			directories.append(copy)
+		return directories
+
+def quietly(run):
+	"""run() with anything it prints thrown away"""
+	def quiet():
+		with contextlib.redirect_stdout(io.StringIO()):
+			run()
+	return quiet
+
+def parse_all(contents):
+	def run():
+		for name, data in contents:
+			Tag(name, data)
+	return Benchmark(run, len(contents), "tags")
+
+@benchmark("tag_bin")
+def bench_tag_bin(context):
+	"""Tag construction (decoding and validation) from raw dumps"""
+	return parse_all(context.contents(DUMP_SUFFIX))
+
+@benchmark("tag_json")
+def bench_tag_json(context):
+	"""Tag construction from Proxmark JSON dumps"""
+	from convert import JSON_SUFFIX
+	return parse_all(context.contents(JSON_SUFFIX))
+
+@benchmark("tag_nfc")
+def bench_tag_nfc(context):
+	"""Tag construction from Flipper NFC files"""
+	from convert import DUMP_SUFFIX as dump_suffix, NFC_SUFFIX
+	# Flipper files are named <UID>.nfc rather than <UID>-dump.nfc
+	contents = context.get("nfc", lambda: [(file.name, file.read_bytes()) for file in (file.with_name(file.name[:-len(dump_suffix)] + NFC_SUFFIX) for file in context.files) if file.exists()])
+	return parse_all(contents)
+
+@benchmark("validate")
+def bench_validate(context):
+	"""Validation alone, of tags which were decoded lazily"""
+	tags = [Tag(name, data, lazy=True) for name, data in context.contents(DUMP_SUFFIX)]
+	def run():
+		for tag in tags:
+			tag._validate(False)
+	return Benchmark(run, len(tags), "tags")
+
+@benchmark("tag_str")
+def bench_tag_str(context):
+	"""Formatting tags as text, as parse.py prints them"""
+	tags = context.tags
+	def run():
+		for tag in tags:
+			str(tag)
+	return Benchmark(run, len(tags), "tags")
+
+@benchmark("load_data")
+def bench_load_data(context):
+	"""parse.load_data(), reading the files as well as parsing them"""
+	from parse import load_data
+	files = context.files
+	return Benchmark(lambda: load_data(files, silent=True), len(files), "tags")
+
+@benchmark("load_library")
+def bench_load_library(context):
+	"""library_checker.load_library() over the whole library, without the tag cache"""
+	import library_checker
+	# load_library() always loads the library below library_checker.LIBRARY_ROOT
+	library_checker.LIBRARY_ROOT = context.root
+	return Benchmark(quietly(lambda: library_checker.load_library(jobs=1)), len(context.library), "tags")
+
+@benchmark("sync_noop")
+def bench_sync_noop(context):
+	"""convert.sync_directory() on directories which are already in sync"""
+	from convert import sync_directory
+	directories = context.copy_directories("sync_noop")
+	run = quietly(lambda: [sync_directory(directory) for directory in directories])
+	run()
+	return Benchmark(run, len(directories), "directories")
+
+@benchmark("sync_full")
+def bench_sync_full(context):
+	"""convert.sync_directory() regenerating every key, JSON and Flipper file from the dumps"""
+	from convert import sync_directory
+	directories = context.copy_directories("sync_full")
+	def setup():
+		for directory in directories:
+			for file in directory.iterdir():
+				if not file.name.endswith(DUMP_SUFFIX):
+					file.unlink()
+	return Benchmark(quietly(lambda: [sync_directory(directory) for directory in directories]), len(directories), "directories", setup)
+
+@benchmark("render_json")
+def bench_render_json(context):
+	"""convert.render_dump_json(), the Proxmark JSON writer"""
+	from convert import render_dump_json
+	tags = context.tags
+	return Benchmark(lambda: [render_dump_json(tag) for tag in tags], len(tags), "tags")
+
+@benchmark("render_nfc")
+def bench_render_nfc(context):
+	"""convert.render_flipper_nfc(), the Flipper NFC writer"""
+	from convert import render_flipper_nfc
+	tags = context.tags
+	return Benchmark(lambda: [render_flipper_nfc(tag) for tag in tags], len(tags), "tags")
+
+@benchmark("write_jsonl")
+def bench_write_jsonl(context):
+	"""parse.write_jsonl(), the JSON Lines output of parse.py"""
+	from parse import write_jsonl
+	tags = context.tags
+	return Benchmark(lambda: write_jsonl(tags, io.StringIO()), len(tags), "tags")
+
+@benchmark("kdf")
+def bench_kdf(context):
+	"""repair.kdf_many() over the UID of every dump in the library"""
+	from repair import kdf_many
+	uids = [data[:4] for name, data in context.contents(DUMP_SUFFIX)]
+	return Benchmark(lambda: kdf_many(uids), len(uids) * 32, "keys")
+
+def run_benchmark(bench, repeat=DEFAULT_REPEAT):
+	"""
+	Time a benchmark, returning the fastest of repeat runs in seconds and the
+	peak memory allocated during one more run (traced separately, since
+	tracing slows everything down) in bytes.
+	"""
+	best = float("inf")
+	for _ in range(repeat):
+		if bench.setup: bench.setup()
+		gc.collect()
+		start = time.perf_counter()
+		bench.run()
+		best = min(best, time.perf_counter() - start)
+
+	if bench.setup: bench.setup()
+	gc.collect()
+	tracemalloc.start()
+	bench.run()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return best, peak
+
+def run_suite(context, names=None, repeat=DEFAULT_REPEAT):
+	"""Run the named benchmarks (all of them by default), yielding (name, result) as each one finishes"""
+	for name in names or BENCHMARKS:
+		bench = BENCHMARKS[name](context)
+		seconds, peak = run_benchmark(bench, repeat)
+		yield name, {
+			"items": bench.items,
+			"unit": bench.unit,
+			"seconds": seconds,
+			"per_second": bench.items / seconds if seconds else None,
+			"peak_bytes": peak,
+		}
+
+def compare_result(result, baseline, threshold=DEFAULT_THRESHOLD):
+	"""The relative changes in throughput and peak memory from a baseline result, and whether either is a regression"""
+	speed = result["per_second"] / baseline["per_second"] - 1 if result["per_second"] and baseline["per_second"] else 0
+	memory = result["peak_bytes"] / baseline["peak_bytes"] - 1 if baseline["peak_bytes"] else 0
+	regressed = speed < -threshold or (memory > threshold and result["peak_bytes"] - baseline["peak_bytes"] > MEMORY_NOISE_BYTES)
+	return speed, memory, regressed
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Measure the performance of the library tooling')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	memory_parser = subparsers.add_parser('memory', help='Measure the memory held by each loaded tag')
+	memory_parser.add_argument('path', nargs='*', default=[LIBRARY_ROOT], help='Dump files or directories to load; defaults to the whole library')
+
+	kdf_parser = subparsers.add_parser('kdf', help='Measure how fast keys are derived, checking them against pycryptodome if it\'s installed')
+	kdf_parser.add_argument('path', nargs='*', default=[LIBRARY_ROOT], help='Dump files or directories whose UIDs are used; defaults to the whole library')
+
+	subparsers.add_parser('imports', help='Check the import time of each script and the time of a command line run against their budgets, and that heavy modules are only imported when needed')
+
+	run_parser = subparsers.add_parser('run', help='Time the hot paths of the tooling, optionally comparing them with a saved baseline')
+	run_parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help='Run only this benchmark; may be given more than once')
+	run_parser.add_argument('--root', default=LIBRARY_ROOT, help='Library to benchmark with; defaults to the directory containing this script')
+	run_parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE, help='Number of dumps used by the benchmarks which don\'t cover the whole library; 0 uses every dump')
+	run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Number of timed runs of each benchmark; the fastest is kept')
+	run_parser.add_argument('--scratch', help='Directory to copy the library directories used by the convert benchmarks into; defaults to the system temporary directory.  A RAM disk keeps disk speed out of the results')
+	run_parser.add_argument('--output', '-o', help='Save the results to this JSON file, for use as a baseline later')
+	run_parser.add_argument('--baseline', '-b', help='Compare the results with those saved in this JSON file, exiting with an error on a regression')
+	run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative loss of throughput or gain in peak memory counted as a regression')
+	args = parser.parse_args()
+
+	if args.command == 'memory':
+		files = list(find_files(args.path))
+		for lazy in [False, True]:
+			count, per_tag = measure_memory(files, lazy)
+			print(f"{'Lazy' if lazy else 'Eager'} tags: {per_tag:.0f} bytes per tag ({count} tags, {per_tag * count / 1024 / 1024:.1f} MiB total)")
+	elif args.command == 'kdf':
+		count, keys_per_second, reference_per_second, matches = measure_kdf(list(find_files(args.path)))
+		print(f"repair.kdf_many: {keys_per_second:,.0f} keys per second ({count} UIDs)")
+		if reference_per_second is None:
+			print("[~] pycryptodome isn't installed, so the keys weren't checked against it")
+		else:
+			print(f"pycryptodome HKDF: {reference_per_second:,.0f} keys per second ({keys_per_second / reference_per_second:.1f}x slower)")
+			if not matches:
+				print("[!] Derived keys differ from pycryptodome's")
+				sys.exit(1)
+			print("[+] Derived keys match pycryptodome's for every UID")
+	elif args.command == 'imports':
+		failed = False
+		for name, milliseconds, budget, unwanted in check_imports():
+			over = milliseconds > budget
+			print(f"{'[!]' if over or unwanted else '[+]'} {name}: {milliseconds:.1f} ms (budget {budget} ms)")
+			if unwanted:
+				print(f"\timports {', '.join(unwanted)} before it's needed")
+			failed |= over or bool(unwanted)
+		sys.exit(1 if failed else 0)
+	elif args.command == 'run':
+		baseline = None
+		if args.baseline:
+			with open(args.baseline) as f:
+				baseline = json.load(f)
+			if baseline.get("version") != RESULTS_VERSION:
+				parser.error(f"{args.baseline} is not a version {RESULTS_VERSION} results file")
+			if baseline.get("sample") != args.sample:
+				print(f"[~] The baseline was run with --sample {baseline.get('sample')}, so its results aren't directly comparable")
+			if set(baseline["results"]) != set(args.only or BENCHMARKS):
+				print("[~] The baseline ran a different set of benchmarks; peak memory depends on what ran before, so it may not be comparable")
+
+		context = BenchmarkContext(args.root, args.sample, args.scratch)
+		results = {}
+		regressions = []
+		try:
+			for name, result in run_suite(context, args.only, args.repeat):
+				results[name] = result
+				line = f"{name:<14} {result['per_second']:>12,.0f} {result['unit']}/s  {result['seconds'] * 1000:>9.1f} ms  {result['peak_bytes'] / 1024 / 1024:>7.2f} MiB peak"
+				if baseline and name in baseline["results"]:
+					speed, memory, regressed = compare_result(result, baseline["results"][name], args.threshold)
+					line += f"  ({speed:+.1%} speed, {memory:+.1%} memory)"
+					if regressed:
+						regressions.append(name)
+						line = "[!] " + line
+				print(line)
+		finally:
+			context.close()
+
+		if args.output:
+			with open(args.output, "w") as f:
+				json.dump({
+					"version": RESULTS_VERSION,
+					"python": platform.python_version(),
+					"platform": platform.platform(),
+					"sample": args.sample,
+					"repeat": args.repeat,
+					"results": results,
+				}, f, indent=2)
+			print(f"Saved results to {args.output}")
+
+		if regressions:
+			print(f"\n[!] {len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+			sys.exit(1)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# Python script to check that convert.py's JSON and Flipper writers still give exactly the output of the original writers
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+#
+# convert.py renders its files from templates for speed.  The original writers, which built the files up field by
+# field, are kept here as the reference: for every dump, the files convert.py would write must match theirs byte for byte.
+
+import sys
+import json
+import argparse
+
+from parse import TOTAL_SECTORS, LIBRARY_ROOT, DUMP_SUFFIX, bytes_to_hex, find_files
+from convert import JSON_CREATOR, JSON_SUFFIX, NFC_SUFFIX, extract_keys_from_blocks, sector_trailer_block, decode_access_bits, load_tag, render_dump_json, render_flipper_nfc
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+def reference_dump_json(tag):
+	keys = extract_keys_from_blocks(tag.blocks)
+
+	output = {
+		"Created": JSON_CREATOR,
+		"FileType": "mfc v2",
+		"Card": {
+			"UID": tag.data['uid'],
+			"ATQA": bytes_to_hex(tag.blocks[0][6:8]),
+			"SAK": bytes_to_hex(tag.blocks[0][5].to_bytes(1, 'big'))
+		},
+		"blocks": {},
+		"SectorKeys": {}
+	}
+
+	for i, block in enumerate(tag.blocks):
+		output['blocks'][str(i)] = bytes_to_hex(block)
+
+	for sector in range(TOTAL_SECTORS):
+		access_bits = bytes_to_hex(tag.blocks[sector_trailer_block(sector)][6:10])
+		output['SectorKeys'][str(sector)] = {
+			"KeyA": bytes_to_hex(keys[sector]),
+			"KeyB": bytes_to_hex(keys[sector+TOTAL_SECTORS]),
+			"AccessConditions": access_bits,
+			"AccessConditionsText": decode_access_bits(sector, access_bits)
+		}
+
+	return json.dumps(output, indent=2)
+
+
+def reference_flipper_nfc(tag):
+	lines = []
+	lines.append("Filetype: Flipper NFC device")
+	lines.append("Version: 4")
+	lines.append("# Device type can be ISO14443-3A, ISO14443-3B, ISO14443-4A, ISO14443-4B, ISO15693-3, FeliCa, NTAG/Ultralight, Mifare Classic, Mifare Plus, Mifare DESFire, SLIX, ST25TB, EMV")
+	lines.append("Device type: Mifare Classic")
+	lines.append("# UID is common for all formats")
+	lines.append(f"UID: {bytes_to_hex(tag.blocks[0][0:4], True)}")
+	lines.append("# ISO14443-3A specific data")
+	# Flipper has the ATQA bytes reversed
+	lines.append(f"ATQA: {bytes_to_hex(int.from_bytes(tag.blocks[0][6:8], 'little').to_bytes(2,'big'), True)}")
+	lines.append(f"SAK: {bytes_to_hex(tag.blocks[0][5].to_bytes(1,'big'))}")
+	lines.append("# Mifare Classic specific data")
+	lines.append("Mifare Classic type: 1K")
+	lines.append("Data format version: 2")
+	lines.append("# Mifare Classic blocks, '??' means unknown data")
+
+	for i, block in enumerate(tag.blocks):
+		lines.append(f"Block {i}: {bytes_to_hex(block, True)}")
+
+	return "\n".join(lines) + "\n"
+
+WRITERS = [(JSON_SUFFIX, render_dump_json, reference_dump_json), (NFC_SUFFIX, render_flipper_nfc, reference_flipper_nfc)]
+
+def check_dump(file):
+	"""The names of the files convert.py would write for a dump which differ from the reference writers' output"""
+	tag = load_tag(file)
+	base = file.name[:-len(DUMP_SUFFIX)]
+	return [f"{base}{suffix}" for suffix, render, reference in WRITERS if render(tag) != reference(tag)]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Check that the JSON and Flipper files convert.py writes match the original writers\' output byte for byte, for every dump')
+	parser.add_argument('path', nargs='*', default=[LIBRARY_ROOT], help=f'Dump files, or directories to check every *{DUMP_SUFFIX} below; defaults to the whole library')
+	args = parser.parse_args()
+
+	checked = 0
+	differing = 0
+	for file in find_files(args.path):
+		try:
+			differences = check_dump(file)
+		except Exception as e:
+			print(f"[!] Failed to parse {file}: {e}")
+			continue
+		checked += len(WRITERS)
+		for name in differences:
+			print(f"[!] {file.parent / name} differs from the reference writer's output")
+		differing += len(differences)
+
+	print(f"\n{differing} of {checked} files differ from the reference writers' output")
+	sys.exit(1 if differing else 0)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# Perceptual index of the filament colors in the library, for finding the filaments closest to a given color
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+
+import os
+import sys
+import heapq
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+from parse import load_batch
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_PATH = Path(__file__).resolve().parent / ".color_index.npz"
+
+# CIE standard illuminant D65 white point, as used by sRGB
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+SRGB_TO_XYZ = np.array([
+	[0.4124564, 0.3575761, 0.1804375],
+	[0.2126729, 0.7151522, 0.0721750],
+	[0.0193339, 0.1191920, 0.9503041]
+])
+
+def hex_to_rgb(colors):
+	"""Turn '#RRGGBB' or '#RRGGBBAA' strings into an (N, 3) array of 0-255 values, ignoring alpha"""
+	return np.array([[int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)] for color in colors], dtype=np.float64).reshape(-1, 3)
+
+def rgb_to_lab(rgb):
+	"""Convert an (N, 3) array of 0-255 sRGB values to CIELAB"""
+	rgb = rgb / 255
+	linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+	xyz = linear @ SRGB_TO_XYZ.T / D65_WHITE
+	f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+	return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+class KDTree():
+	"""
+	A static k-d tree stored implicitly in arrays: points are reordered so the
+	node for the range [low, high) is the median at (low + high) // 2, split
+	along dims[median], with its children in [low, median) and (median, high).
+	"""
+
+	def __init__(self, points, dims, ids):
+		self.points = points
+		self.dims = dims
+		self.ids = ids
+		# Plain lists are much faster than numpy arrays to index one element at a time
+		self.point_list = points.tolist()
+		self.dim_list = dims.tolist()
+
+	@classmethod
+	def build(cls, points):
+		points = np.asarray(points, dtype=np.float64)
+		ids = np.arange(len(points))
+		dims = np.zeros(len(points), dtype=np.int8)
+
+		stack = [(0, len(points))]
+		while stack:
+			low, high = stack.pop()
+			if high - low < 1:
+				continue
+			# Split along the widest dimension of this node's points
+			spread = points[low:high].max(axis=0) - points[low:high].min(axis=0)
+			dim = int(np.argmax(spread))
+			order = np.argsort(points[low:high, dim], kind="stable") + low
+			points[low:high] = points[order]
+			ids[low:high] = ids[order]
+			median = (low + high) // 2
+			dims[median] = dim
+			stack.append((low, median))
+			stack.append((median + 1, high))
+
+		return cls(points, dims, ids)
+
+	def query(self, point, k=1):
+		"""The ids of the k points nearest to point and their distances, closest first"""
+		if k < 1:
+			return []
+		point = [float(value) for value in point]
+		points = self.point_list
+		dims = self.dim_list
+		best = [] # Max-heap of (-squared distance, position) of the best points so far
+
+		def search(low, high):
+			if low >= high:
+				return
+			median = (low + high) // 2
+			candidate = points[median]
+			distance = sum((a - b) ** 2 for a, b in zip(candidate, point))
+			if len(best) < k:
+				heapq.heappush(best, (-distance, median))
+			elif distance < -best[0][0]:
+				heapq.heapreplace(best, (-distance, median))
+
+			offset = point[dims[median]] - candidate[dims[median]]
+			near, far = ((low, median), (median + 1, high)) if offset < 0 else ((median + 1, high), (low, median))
+			search(*near)
+			# Only look on the other side of the split if it could hold something closer
+			if len(best) < k or offset * offset < -best[0][0]:
+				search(*far)
+
+		search(0, len(points))
+		return [(int(self.ids[position]), (-distance) ** 0.5) for distance, position in sorted(best, reverse=True)]
+
+class ColorIndex():
+	"""
+	Every filament color in the library (both colors of dual-color tags)
+	with the color directories it was found in, indexed by CIELAB value so
+	the closest colors can be found by their CIE76 color difference (ΔE).
+	"""
+
+	def __init__(self, colors, paths, tree, signature):
+		self.colors = colors
+		self.paths = paths
+		self.tree = tree
+		self.signature = signature
+
+	@classmethod
+	def build(cls, root, files):
+		batch = load_batch(files, silent=True)
+		entries = {}
+		for file, color_field in zip(batch.filenames, batch.columns["filament_color"]):
+			# <Category>/<Material>/<Color Name>/<UUID>/-dump.bin
+			path = file.parent.parent.relative_to(root).as_posix()
+			for color in str(color_field).split(" / "):
+				entries.setdefault((color[:7], path), None)
+
+		colors = [color for color, path in entries]
+		paths = [path for color, path in entries]
+		return cls(colors, paths, KDTree.build(rgb_to_lab(hex_to_rgb(colors))), library_signature(files))
+
+	def nearest(self, color, k=5):
+		"""The k (color, color directory, ΔE) entries closest to a '#RRGGBB' color"""
+		return [(self.colors[i], self.paths[i], distance) for i, distance in self.tree.query(rgb_to_lab(hex_to_rgb([color]))[0], k)]
+
+	def save(self, path=DEFAULT_INDEX_PATH):
+		tmp_path = Path(path).with_name(Path(path).name + ".tmp.npz")
+		np.savez(tmp_path, version=INDEX_VERSION, colors=np.array(self.colors), paths=np.array(self.paths), points=self.tree.points, dims=self.tree.dims, ids=self.tree.ids, signature=self.signature)
+		os.replace(tmp_path, path)
+
+	@classmethod
+	def load(cls, path=DEFAULT_INDEX_PATH):
+		with np.load(path) as data:
+			if int(data["version"]) != INDEX_VERSION:
+				raise ValueError(f"{path} is not a version {INDEX_VERSION} color index")
+			return cls(data["colors"].tolist(), data["paths"].tolist(), KDTree(data["points"], data["dims"], data["ids"]), str(data["signature"]))
+
+def library_signature(files):
+	"""Digest of the path, size and modification time of every dump file, which changes whenever the library does"""
+	digest = hashlib.blake2b(digest_size=16)
+	for file in sorted(files):
+		st = os.stat(file)
+		digest.update(f"{file}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+	return digest.hexdigest()
+
+def load_color_index(root, files, path=DEFAULT_INDEX_PATH, rebuild=False):
+	"""Load the color index from disk, building and saving it first if it's missing or out of date"""
+	if not rebuild:
+		try:
+			index = ColorIndex.load(path)
+			if index.signature == library_signature(files):
+				return index
+		except (OSError, ValueError, KeyError):
+			pass
+
+	index = ColorIndex.build(root, files)
+	index.save(path)
+	return index
@@ -4,22 +4,29 @@
 # Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
 # Written by Vinyl Da.i'gyu-Kazotetsu (www.queengoob.org), 2026
 
+import io
 import sys
 import argparse
 import json
 import os
+import pickle
+import contextlib
 
 from pathlib import Path
 
-from parse import Tag, bytes_to_hex, BLOCKS_PER_SECTOR, TOTAL_SECTORS
+from tag_cache import TagCache
+from parse import Tag, FIELDS, BYTES_PER_BLOCK, BLOCKS_PER_SECTOR, TOTAL_SECTORS, DUMP_SUFFIX
 
 if not sys.version_info >= (3, 6):
 	raise Exception("Python 3.6 or higher is required!")
 
-DUMP_SUFFIX = "-dump.bin"
 KEY_SUFFIX = "-key.bin"
 JSON_SUFFIX = "-dump.json"
 NFC_SUFFIX = ".nfc"
+JSON_CREATOR = "queengooborg/Bambu-Lab-RFID-Library/convert.py"
+IGNORED_FILES = [".DS_Store", "_attribution.txt"]
+STATE_VERSION = 1
+DEFAULT_STATE_PATH = Path(__file__).resolve().parent / ".convert_state"
 DATA_ACCESS = {
 	0x00: "read AB; write AB; increment AB; decrement transfer restore AB",
 	0x01: "read AB; decrement transfer restore AB",
@@ -84,11 +91,18 @@ def extract_keys_from_blocks(blocks):
 	keysB = []
 	for sector in range(TOTAL_SECTORS):
 		trailer = blocks[sector_trailer_block(sector)]
-		keysA.append(trailer[0:6])
-		keysB.append(trailer[10:16])
+		keysA.append(trailer[FIELDS["key_a"].slice])
+		keysB.append(trailer[FIELDS["key_b"].slice])
 	return keysA + keysB
 
 
+def load_tag(file, cache=None):
+	if cache:
+		return cache.load(file)
+	with open(file, "rb") as f:
+		return Tag(file.name, f.read(), lazy=True)
+
+
 def blocks_equal(a, b):
 	return len(a) == len(b) and all(x == y for x, y in zip(a, b))
 
@@ -106,66 +120,122 @@ def write_key_bin(path, keys):
 			f.write(key)
 
 
-def write_dump_json(path, tag):
-	keys = extract_keys_from_blocks(tag.blocks)
-
-	output = {
-		"Created": "queengooborg/Bambu-Lab-RFID-Library/convert.py",
-		"FileType": "mfc v2",
-		"Card": {
-			"UID": tag.data['uid'],
-			"ATQA": bytes_to_hex(tag.blocks[0][6:8]),
-			"SAK": bytes_to_hex(tag.blocks[0][5].to_bytes(1, 'big'))
-		},
-		"blocks": {},
-		"SectorKeys": {}
-	}
-
-	for i, block in enumerate(tag.blocks):
-		output['blocks'][str(i)] = bytes_to_hex(block)
+# Output templates, built once per block count.  The JSON template is json.dumps() of a skeleton with a %s placeholder for every value, so filling it in gives exactly what json.dump() would have written.
+JSON_TEMPLATES = {}
+FLIPPER_TEMPLATES = {}
+ACCESS_CONDITIONS_TEXT = {}
+
+def json_template(block_count):
+	template = JSON_TEMPLATES.get(block_count)
+	if template is None:
+		skeleton = {
+			"Created": JSON_CREATOR,
+			"FileType": "mfc v2",
+			"Card": {
+				"UID": "%s",
+				"ATQA": "%s",
+				"SAK": "%s"
+			},
+			"blocks": {str(i): "%s" for i in range(block_count)},
+			"SectorKeys": {}
+		}
+		for sector in range(TOTAL_SECTORS):
+			text = {f"block{sector * BLOCKS_PER_SECTOR + i}": "%s" for i in range(BLOCKS_PER_SECTOR)}
+			text["UserData"] = "%s"
+			skeleton["SectorKeys"][str(sector)] = {
+				"KeyA": "%s",
+				"KeyB": "%s",
+				"AccessConditions": "%s",
+				"AccessConditionsText": text
+			}
+		template = JSON_TEMPLATES[block_count] = json.dumps(skeleton, indent=2)
+	return template
+
+
+def flipper_template(block_count):
+	template = FLIPPER_TEMPLATES.get(block_count)
+	if template is None:
+		lines = [
+			"Filetype: Flipper NFC device",
+			"Version: 4",
+			"# Device type can be ISO14443-3A, ISO14443-3B, ISO14443-4A, ISO14443-4B, ISO15693-3, FeliCa, NTAG/Ultralight, Mifare Classic, Mifare Plus, Mifare DESFire, SLIX, ST25TB, EMV",
+			"Device type: Mifare Classic",
+			"# UID is common for all formats",
+			"UID: %s",
+			"# ISO14443-3A specific data",
+			"ATQA: %s",
+			"SAK: %s",
+			"# Mifare Classic specific data",
+			"Mifare Classic type: 1K",
+			"Data format version: 2",
+			"# Mifare Classic blocks, '??' means unknown data"
+		]
+		lines.extend(f"Block {i}: %s" for i in range(block_count))
+		template = FLIPPER_TEMPLATES[block_count] = "\n".join(lines) + "\n"
+	return template
+
+
+def access_conditions_text(access_bytes):
+	"""The access condition text of the blocks in a sector, looked up by the hex of the sector's 3 access bytes"""
+	text = ACCESS_CONDITIONS_TEXT.get(access_bytes)
+	if text is None:
+		decoded = decode_access_bits(0, access_bytes + "00")
+		text = ACCESS_CONDITIONS_TEXT[access_bytes] = tuple(decoded[f"block{i}"] for i in range(BLOCKS_PER_SECTOR))
+	return text
+
+
+def hex_field(hex_data, name, sector=0, chars_per_byte=2):
+	"""Cut a field out of the hex of a whole tag, which has chars_per_byte characters for each byte"""
+	field = FIELDS[name]
+	start = (field.start + sector * BLOCKS_PER_SECTOR * BYTES_PER_BLOCK) * chars_per_byte
+	return hex_data[start:start + field.length * chars_per_byte]
+
+
+def render_dump_json(tag):
+	hex_data = tag.buffer.hex().upper()
+	block_width = 2 * BYTES_PER_BLOCK
+	values = [tag.data['uid'], hex_field(hex_data, "atqa"), hex_field(hex_data, "sak")]
+	values.extend(hex_data[i:i + block_width] for i in range(0, len(hex_data), block_width))
 
 	for sector in range(TOTAL_SECTORS):
-		access_bits = bytes_to_hex(tag.blocks[sector_trailer_block(sector)][6:10])
-		output['SectorKeys'][str(sector)] = {
-			"KeyA": bytes_to_hex(keys[sector]),
-			"KeyB": bytes_to_hex(keys[sector+TOTAL_SECTORS]),
-			"AccessConditions": access_bits,
-			"AccessConditionsText": decode_access_bits(sector, access_bits)
-		}
+		access_bits = hex_field(hex_data, "access_bits", sector)
+		values.append(hex_field(hex_data, "key_a", sector))
+		values.append(hex_field(hex_data, "key_b", sector))
+		values.append(access_bits)
+		values.extend(access_conditions_text(access_bits[:6]))
+		values.append(access_bits[6:])
+
+	return json_template(len(tag.buffer) // BYTES_PER_BLOCK) % tuple(values)
 
+
+def render_flipper_nfc(tag):
+	# Every byte is 2 hex digits and a space, apart from the last one in each block
+	hex_data = tag.buffer.hex(" ").upper()
+	block_width = 3 * BYTES_PER_BLOCK
+	values = [
+		hex_field(hex_data, "uid", chars_per_byte=3).rstrip(),
+		# Flipper has the ATQA bytes reversed
+		FIELDS['atqa'].unpack(tag.buffer)[::-1].hex(" ").upper(),
+		hex_field(hex_data, "sak", chars_per_byte=3).rstrip()
+	]
+	values.extend(hex_data[i:i + block_width - 1] for i in range(0, len(hex_data), block_width))
+
+	return flipper_template(len(tag.buffer) // BYTES_PER_BLOCK) % tuple(values)
+
+
+def write_dump_json(path, tag):
 	with open(path, "w") as f:
-		json.dump(output, f, indent=2)
+		f.write(render_dump_json(tag))
 
 
 def write_flipper_nfc(path, tag):
-	keys = extract_keys_from_blocks(tag.blocks)
-
-	lines = []
-	lines.append("Filetype: Flipper NFC device")
-	lines.append("Version: 4")
-	lines.append("# Device type can be ISO14443-3A, ISO14443-3B, ISO14443-4A, ISO14443-4B, ISO15693-3, FeliCa, NTAG/Ultralight, Mifare Classic, Mifare Plus, Mifare DESFire, SLIX, ST25TB, EMV")
-	lines.append("Device type: Mifare Classic")
-	lines.append("# UID is common for all formats")
-	lines.append(f"UID: {bytes_to_hex(tag.blocks[0][0:4], True)}")
-	lines.append("# ISO14443-3A specific data")
-	# Flipper has the ATQA bytes reversed
-	lines.append(f"ATQA: {bytes_to_hex(int.from_bytes(tag.blocks[0][6:8], 'little').to_bytes(2,'big'), True)}")
-	lines.append(f"SAK: {bytes_to_hex(tag.blocks[0][5].to_bytes(1,'big'))}")
-	lines.append("# Mifare Classic specific data")
-	lines.append("Mifare Classic type: 1K")
-	lines.append("Data format version: 2")
-	lines.append("# Mifare Classic blocks, '??' means unknown data")
-
-	for i, block in enumerate(tag.blocks):
-		lines.append(f"Block {i}: {bytes_to_hex(block, True)}")
-
 	with open(path, "w") as f:
-		f.write("\n".join(lines) + "\n")
+		f.write(render_flipper_nfc(tag))
 
 
 # Check directory and write any missing files
 
-def normalize_filenames(path):
+def normalize_filenames(path, cache=None):
 	"""
 	Rename any *.bin dump files that don't use the standard -dump.bin suffix
 	to the hf-mf-<UID>-dump.bin convention, and rename their matching key file
@@ -178,8 +248,7 @@ def normalize_filenames(path):
 			continue  # already a standard file
 
 		try:
-			with open(file, 'rb') as f:
-				tag = Tag(file.name, f.read())
+			tag = load_tag(file, cache)
 		except Exception:
 			continue  # not a valid dump — leave it alone
 
@@ -205,13 +274,20 @@ def normalize_filenames(path):
 	return renamed
 
 
-def sync_directory(path):
+def sync_directory(path, cache=None):
+	"""
+	Check the files of every tag in a directory against each other and
+	generate any missing formats.  Returns whether the directory is fully
+	in sync, i.e. nothing needed a warning.
+	"""
+	clean = True
+
 	# If we're given a specific file, get the parent instead
 	if path.is_file():
 		path = path.parent
 
 	# Rename any non-standard *.bin dumps to hf-mf-<UID>-dump.bin before grouping
-	normalize_filenames(path)
+	normalize_filenames(path, cache)
 
 	files = list(path.iterdir())
 	unhandled_files = []
@@ -235,7 +311,7 @@ def sync_directory(path):
 			base = name[:-len(NFC_SUFFIX)]
 			groups.setdefault(base, {})["nfc"] = file
 		else:
-			if file.name not in [".DS_Store", "_attribution.txt"]:
+			if file.name not in IGNORED_FILES:
 				unhandled_files.append(file.name)
 
 	for base, entries in groups.items():
@@ -247,15 +323,15 @@ def sync_directory(path):
 				continue
 
 			try:
-				with open(file, "rb") as f:
-					tag = Tag(file.name, f.read())
-					# Ensure dump is first so it's the reference tag for comparisons
-					if kind == "dump":
-						tags.insert(0, (kind, tag))
-					else:
-						tags.append((kind, tag))
+				tag = load_tag(file, cache)
+				# Ensure dump is first so it's the reference tag for comparisons
+				if kind == "dump":
+					tags.insert(0, (kind, tag))
+				else:
+					tags.append((kind, tag))
 			except Exception as e:
 				print(f"  [!] Failed to parse {file.name}: {e}")
+				clean = False
 
 		if not tags:
 			continue
@@ -270,6 +346,7 @@ def sync_directory(path):
 				mismatch = True
 
 		if mismatch:
+			clean = False
 			continue
 
 		tag = ref_tag
@@ -280,6 +357,7 @@ def sync_directory(path):
 				if not blocks_equal(b''.join(keys), f.read()):
 					print(f"  [!] MISMATCH between {ref_kind} and keys")
 					print("      Consider deleting malformed key file")
+					clean = False
 					continue
 
 		# generate missing files
@@ -305,15 +383,171 @@ def sync_directory(path):
 
 	if unhandled_files:
 		print(f"  [!] UNKNOWN FILES in folder: {', '.join(unhandled_files)}")
+		clean = False
+
+	return clean
+
+
+def check_directory(path):
+	"""
+	Regenerate the JSON files this script wrote for every tag in a directory
+	in memory and compare them with the files on disk, without changing
+	anything.  JSON dumps from other tools, and Flipper files (which can't be
+	told apart from those saved by a Flipper), are left out.  Returns the
+	number of files checked and the number that differ.
+	"""
+	checked = 0
+	differing = 0
+	for dump in sorted(path.glob(f"*{DUMP_SUFFIX}")):
+		file = path / f"{dump.name[:-len(DUMP_SUFFIX)]}{JSON_SUFFIX}"
+		try:
+			with open(file, "rb") as f:
+				existing = f.read()
+		except FileNotFoundError:
+			continue
+		if f'"Created": "{JSON_CREATOR}"'.encode() not in existing[:128]:
+			continue
+
+		try:
+			tag = load_tag(dump)
+		except Exception as e:
+			print(f"  [!] Failed to parse {dump}: {e}")
+			continue
+
+		checked += 1
+		if existing != render_dump_json(tag).encode():
+			print(f"  [!] {file} differs from regenerated output")
+			differing += 1
+	return checked, differing
+
+
+def directory_fingerprint(path):
+	"""The name, size and modification time of every file in a directory"""
+	fingerprint = []
+	with os.scandir(path) as entries:
+		for entry in entries:
+			if entry.is_file():
+				st = entry.stat()
+				fingerprint.append((entry.name, st.st_size, st.st_mtime_ns))
+	return tuple(sorted(fingerprint))
+
+
+def sync_directory_captured(path):
+	"""
+	Run sync_directory() in a worker process, returning its output along
+	with whether the directory is in sync and its fingerprint afterwards.
+	"""
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		clean = sync_directory(path)
+	return output.getvalue(), clean, directory_fingerprint(path)
+
+
+class SyncState():
+	"""
+	Remembers the fingerprint of every directory that was fully in sync at
+	the end of the last run, so directories whose files haven't changed
+	since then can be skipped without opening any of them.  Directories
+	which needed a warning are not recorded, so they are checked (and warned
+	about) again every run.
+	"""
+
+	def __init__(self, path=DEFAULT_STATE_PATH):
+		self.path = Path(path)
+		self.fingerprints = {}
+		self.dirty = False
+
+		try:
+			with open(self.path, "rb") as f:
+				version, fingerprints = pickle.load(f)
+			if version == STATE_VERSION:
+				self.fingerprints = fingerprints
+		except FileNotFoundError:
+			pass
+		except Exception:
+			# Corrupt or incompatible state, start from scratch
+			self.dirty = True
+
+	def unchanged(self, path, fingerprint):
+		return self.fingerprints.get(os.path.abspath(path)) == fingerprint
+
+	def record(self, path, clean, fingerprint):
+		key = os.path.abspath(path)
+		if clean:
+			if self.fingerprints.get(key) != fingerprint:
+				self.fingerprints[key] = fingerprint
+				self.dirty = True
+		elif self.fingerprints.pop(key, None) is not None:
+			self.dirty = True
+
+	def save(self):
+		if not self.dirty:
+			return
+
+		tmp_path = self.path.with_name(self.path.name + ".tmp")
+		with open(tmp_path, "wb") as f:
+			pickle.dump((STATE_VERSION, self.fingerprints), f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, self.path)
+		self.dirty = False
 
 
 if __name__ == "__main__":
 
 	parser = argparse.ArgumentParser(description='Convert a tag from binary to JSON/Flipper/nfc/keys/parsed text')
 	parser.add_argument('directory', nargs='+', help='Directory(ies) containing tag data')
+	parser.add_argument('--no_cache', action='store_true', help='Parse every tag and check every directory again instead of reusing the cache of previously parsed tags and synced directories')
+	parser.add_argument('--check', action='store_true', help='Only compare the JSON files written by this script with freshly generated ones, without writing anything')
+	parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes used to sync directories; 0 uses every CPU core.  Worker processes don\'t use the tag cache')
 	args = parser.parse_args()
 
+	if args.check:
+		checked = 0
+		differing = 0
+		for dir_path in args.directory:
+			for root, dirs, files in os.walk(dir_path):
+				if files:
+					counts = check_directory(Path(root))
+					checked += counts[0]
+					differing += counts[1]
+		print(f"\n{differing} of {checked} files differ from regenerated output")
+		sys.exit(1 if differing else 0)
+
+	cache = None if args.no_cache else TagCache()
+	state = None if args.no_cache else SyncState()
+	jobs = args.jobs or os.cpu_count()
+
+	# Only a stat() of each file is needed to skip a directory that hasn't changed since it was last in sync
+	directories = []
+	skipped = 0
 	for dir_path in args.directory:
 		for root, dirs, files in os.walk(dir_path):
-			if files:
-				sync_directory(Path(root))
+			if not files:
+				continue
+			if state and state.unchanged(root, directory_fingerprint(root)):
+				skipped += 1
+			else:
+				directories.append(Path(root))
+
+	if jobs == 1 or len(directories) < 2:
+		for path in directories:
+			clean = sync_directory(path, cache)
+			if state:
+				state.record(path, clean, directory_fingerprint(path))
+	else:
+		# Output is captured per directory and printed in walk order, so it matches a serial run
+		import multiprocessing
+
+		with multiprocessing.Pool(jobs) as pool:
+			chunk_size = max(1, min(64, len(directories) // (jobs * 4)))
+			for path, (output, clean, fingerprint) in zip(directories, pool.imap(sync_directory_captured, directories, chunk_size)):
+				sys.stdout.write(output)
+				if state:
+					state.record(path, clean, fingerprint)
+
+	if skipped:
+		print(f"\nSkipped {skipped} unchanged director{'y' if skipped == 1 else 'ies'}")
+
+	if cache:
+		cache.save()
+	if state:
+		state.save()
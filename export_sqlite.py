@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# Python script to export the decoded tags of the library into a SQLite database, updating it incrementally
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+#
+# Tables:
+#   tags: one row per dump file, with its path and path components, every field of Tag.data (grouped
+#         fields such as the temperatures as their own columns), its warnings as a JSON list and its raw dump
+#   blocks: one row per block of each dump, as a BLOB
+#   files: the size and modification time each dump had when it was exported, used to find changed files
+
+import sys
+import json
+import sqlite3
+import argparse
+from pathlib import Path
+
+from parse import Tag, TAG_LAYOUT, BYTES_PER_BLOCK, LIBRARY_ROOT, read_ahead, flatten_data, find_dumps
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+DEFAULT_DATABASE_PATH = LIBRARY_ROOT / "library.sqlite"
+SCHEMA_VERSION = 1
+BATCH_SIZE = 500 # Tags written per transaction
+
+SQL_TYPES = {"uint": "INTEGER", "float": "REAL"} # Everything else is stored as text
+PATH_COLUMNS = ["category", "material", "color", "directory"] # <Category>/<Material>/<Color Name>/<UUID>/-dump.bin
+DATA_COLUMNS = [field.name for field in TAG_LAYOUT.fields]
+INDEXED_COLUMNS = ["uid", "material_id", "variant_id", "filament_type", "production_date"]
+
+TAG_COLUMNS = ["id", "path", *PATH_COLUMNS, *DATA_COLUMNS, "warnings", "dump"]
+
+def schema():
+	"""The statements which create the database"""
+	data_columns = ",\n\t\t".join(f"{field.name} {SQL_TYPES.get(field.type, 'TEXT')}" for field in TAG_LAYOUT.fields)
+	statements = [
+		"CREATE TABLE meta (key TEXT PRIMARY KEY, value)",
+		"CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)",
+		f"""CREATE TABLE tags (
+		id INTEGER PRIMARY KEY REFERENCES files (id) ON DELETE CASCADE,
+		path TEXT NOT NULL,
+		{", ".join(f"{column} TEXT" for column in PATH_COLUMNS)},
+		{data_columns},
+		warnings TEXT NOT NULL,
+		dump BLOB NOT NULL
+	)""",
+		"CREATE TABLE blocks (tag INTEGER NOT NULL REFERENCES tags (id) ON DELETE CASCADE, block INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (tag, block)) WITHOUT ROWID",
+		*(f"CREATE INDEX tags_{column} ON tags ({column})" for column in INDEXED_COLUMNS),
+		"CREATE INDEX tags_path ON tags (path)",
+	]
+	return statements
+
+def open_database(path=DEFAULT_DATABASE_PATH, rebuild=False):
+	"""Open (creating it if needed) the database, starting over if it was made with a different schema"""
+	db = sqlite3.connect(path, isolation_level=None)
+	db.execute("PRAGMA journal_mode = WAL")
+	db.execute("PRAGMA synchronous = NORMAL")
+	db.execute("PRAGMA foreign_keys = ON")
+
+	try:
+		version = db.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()[0]
+	except (sqlite3.OperationalError, TypeError):
+		version = None
+
+	if rebuild or version != SCHEMA_VERSION:
+		db.execute("BEGIN")
+		for table in ["blocks", "tags", "files", "meta"]:
+			db.execute(f"DROP TABLE IF EXISTS {table}")
+		for statement in schema():
+			db.execute(statement)
+		db.execute("INSERT INTO meta VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+		db.execute("COMMIT")
+
+	return db
+
+def tag_row(file_id, path, tag):
+	"""The row of the tags table for a tag"""
+	data = flatten_data(tag.data)
+	components = Path(path).parts[:-1]
+	components = list(components[:len(PATH_COLUMNS)]) + [None] * (len(PATH_COLUMNS) - len(components))
+	return (file_id, path, *components, *(data[column] for column in DATA_COLUMNS), json.dumps(tag.warnings), bytes(tag.buffer))
+
+def block_rows(file_id, tag):
+	buffer = bytes(tag.buffer)
+	return [(file_id, block, buffer[start:start + BYTES_PER_BLOCK]) for block, start in enumerate(range(0, len(buffer), BYTES_PER_BLOCK))]
+
+def export_library(db, root=LIBRARY_ROOT, silent=False):
+	"""
+	Bring the database up to date with the dump files below root: tags whose
+	files are new or have a different size or modification time are (re)parsed
+	and written, and tags whose files are gone are deleted.  Returns the number
+	of (written, deleted, unchanged) files.
+	"""
+	root = Path(root)
+	known = {path: (file_id, size, mtime_ns) for file_id, path, size, mtime_ns in db.execute("SELECT id, path, size, mtime_ns FROM files")}
+
+	changed = []
+	seen = set()
+	for file in find_dumps(root):
+		path = file.relative_to(root).as_posix()
+		seen.add(path)
+		st = file.stat()
+		previous = known.get(path)
+		if previous is None or previous[1:] != (st.st_size, st.st_mtime_ns):
+			changed.append((file, path, st))
+
+	deleted = [known[path][0] for path in known if path not in seen]
+	unchanged = len(seen) - len(changed)
+
+	def write_batch(files, tags, blocks):
+		db.execute("BEGIN")
+		# Deleting a file row cascades to its tag and blocks, so changed tags are rewritten from scratch
+		db.executemany("DELETE FROM files WHERE id = ?", [(row[0],) for row in files])
+		db.executemany("INSERT INTO files (id, path, size, mtime_ns) VALUES (?, ?, ?, ?)", files)
+		db.executemany(f"INSERT INTO tags ({', '.join(TAG_COLUMNS)}) VALUES ({', '.join('?' * len(TAG_COLUMNS))})", tags)
+		db.executemany("INSERT INTO blocks (tag, block, data) VALUES (?, ?, ?)", blocks)
+		db.execute("COMMIT")
+
+	next_id = (db.execute("SELECT max(id) FROM files").fetchone()[0] or 0) + 1
+	files, tags, blocks = [], [], []
+	written = 0
+	by_file = {file: (path, st) for file, path, st in changed}
+	for file, contents, error in read_ahead(by_file):
+		path, st = by_file[file]
+		file_id = known[path][0] if path in known else next_id
+		if path not in known:
+			next_id += 1
+
+		try:
+			if error is not None:
+				raise error
+			tag = Tag(path, contents)
+		except Exception as e:
+			if not silent: print(f"[!] {path}: {e}, skipping")
+			# Forget any previous version of a file that can't be read any more
+			if path in known: deleted.append(file_id)
+			continue
+
+		files.append((file_id, path, st.st_size, st.st_mtime_ns))
+		tags.append(tag_row(file_id, path, tag))
+		blocks.extend(block_rows(file_id, tag))
+		written += 1
+		if len(files) >= BATCH_SIZE:
+			write_batch(files, tags, blocks)
+			files, tags, blocks = [], [], []
+
+	if files:
+		write_batch(files, tags, blocks)
+
+	if deleted:
+		db.execute("BEGIN")
+		db.executemany("DELETE FROM files WHERE id = ?", [(file_id,) for file_id in deleted])
+		db.execute("COMMIT")
+
+	return written, len(deleted), unchanged
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Export the decoded tags of the library into a SQLite database, only updating tags whose files have changed since the last export')
+	parser.add_argument('--database', '-d', default=DEFAULT_DATABASE_PATH, help='Database file to create or update')
+	parser.add_argument('--rebuild', action='store_true', help='Start the database over instead of updating it')
+	args = parser.parse_args()
+
+	db = open_database(args.database, args.rebuild)
+	written, deleted, unchanged = export_library(db)
+	db.execute("PRAGMA optimize")
+	db.close()
+
+	print(f"Wrote {written} tags, deleted {deleted} and left {unchanged} unchanged in {args.database}")
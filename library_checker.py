@@ -4,20 +4,20 @@
 # Reads each directory and compares the color data in it; if there are tags with two different color codes, print them out.
 # Also prints out an error if the tag doesn't appear to be in the correct directory according to its data, or if it encounters tags which don't parse correctly.
 
+import os
 import sys
 import argparse
-
-from rich.console import Console
+import hashlib
 
 from pathlib import Path
 
-from parse import Tag, bytes_to_hex, BLOCKS_PER_SECTOR, TOTAL_SECTORS
+from tag_cache import TagCache
+from parse import Tag, TagDataError, FIELDS, bytes_to_hex, read_ahead, load_batch, COMPARISON_BLOCKS, BYTES_PER_BLOCK, BLOCKS_PER_SECTOR, TOTAL_SECTORS, READ_AHEAD_THREADS, READ_AHEAD_DEPTH, LIBRARY_ROOT, find_dumps
 
 if not sys.version_info >= (3, 6):
 	raise Exception("Python 3.6 or higher is required!")
 
-DUMP_SUFFIX = "-dump.bin"
-LIBRARY_ROOT = Path.cwd()
+CHUNK_SIZE = 256 # Maximum number of files handed to a worker process at once
 
 # These map dicts map the 'filament_type' and 'detailed_filament_type' in the tags to the names used in the library.
 
@@ -49,32 +49,244 @@ MATERIAL_MAP = {
 	'PLA': ['PLA Silk Multi-Color'],
 }
 
-def load_library(print_error=False, debug_color=None):
-	library = {}
-
-	for file in LIBRARY_ROOT.rglob(f'*{DUMP_SUFFIX}'):
-		if file.parent == LIBRARY_ROOT:
-			# skip files that are in the root
-			continue
+def check_files(files):
+	"""
+	Parse a chunk of dump files in a worker process.  Tags are parsed without
+	fail_on_warn so they can be cached; load_library() applies the strict
+	check afterwards.  Only each tag's raw data and issues (Tag.record()) are
+	sent back, from which the tag is recreated with its fields decoded as
+	they're needed.  Returns a list of (file, record, error) tuples in the same
+	order as the input.
+	"""
+	results = []
+	for file in files:
 		try:
 			with open(file, 'rb') as f:
-				tag = Tag(file.name, f.read(), fail_on_warn=True)
+				file, tag, error = check_file(file, f.read())
 		except Exception as e:
-			if print_error:
-				print(f'\t[!] Library load failed to parse {file.relative_to(LIBRARY_ROOT)}: {e}')
+			tag, error = None, str(e)
+		results.append((file, None if tag is None else tag.record(), error))
+	return results
+
+def check_file(file, data):
+	try:
+		return (file, Tag(file.name, data), None)
+	except Exception as e:
+		return (file, None, str(e))
+
+def iter_checked_files(files, jobs=1, cache=None, io_threads=READ_AHEAD_THREADS, read_ahead_depth=READ_AHEAD_DEPTH):
+	"""
+	Yield the results of check_files() for each file, in input order.  Files
+	with an up-to-date cache entry are not parsed again.  With jobs > 1 the
+	remaining files are split into contiguous chunks and spread across a
+	process pool; results are still yielded in the original order so the
+	output matches a serial run.  Otherwise they are read ahead on
+	io_threads threads while the previous ones are parsed.
+	"""
+	cached = [cache.get(file) if cache else None for file in files]
+	to_parse = [file for file, tag in zip(files, cached) if tag is None]
+
+	pool = None
+	if jobs == 1 or len(to_parse) < 2:
+		parsed = (check_file(file, data) if error is None else (file, None, str(error)) for file, data, error in read_ahead(to_parse, io_threads, read_ahead_depth))
+	else:
+		chunk_size = max(1, min(CHUNK_SIZE, -(-len(to_parse) // (jobs * 4))))
+		chunks = [to_parse[i:i+chunk_size] for i in range(0, len(to_parse), chunk_size)]
+		import multiprocessing
+		pool = multiprocessing.Pool(jobs)
+		parsed = ((file, None if record is None else Tag.from_parsed(file.name, record[0], None, record[1]), error) for results in pool.imap(check_files, chunks) for file, record, error in results)
+
+	try:
+		for file, tag in zip(files, cached):
+			if tag is not None:
+				yield file, tag, None
 				continue
 
-		# Assumes dir structure is <Category>/<Material>/<Color Name>/<UUID>/-dump.bin
+			result = next(parsed)
+			if cache and result[1] is not None:
+				cache.put(file, result[1])
+			yield result
+	finally:
+		if pool:
+			pool.terminate()
+
+def content_hash(data):
+	return hashlib.blake2b(data, digest_size=16).digest()
+
+def semantic_fingerprint(tag):
+	"""
+	Hash of the blocks holding the filament data (COMPARISON_BLOCKS), leaving
+	out the UID, keys and signature.  The two tags of a spool share it.
+	"""
+	view = memoryview(tag.buffer)
+	return content_hash(b"".join(view[block * BYTES_PER_BLOCK:(block + 1) * BYTES_PER_BLOCK] for block in COMPARISON_BLOCKS))
+
+class TagIndex():
+	"""
+	Hash indexes of the files in the library by exact content, UID and
+	semantic fingerprint, built in a single pass as the library is loaded.
+	"""
+
+	def __init__(self):
+		self.by_content = {}
+		self.by_uid = {}
+		self.by_fingerprint = {}
+		self.hashes = {}
+
+	def add(self, file, tag):
+		self.hashes[file] = content_hash(tag.buffer)
+		self.by_content.setdefault(self.hashes[file], []).append(file)
+		self.by_uid.setdefault(tag.data['uid'], []).append(file)
+		self.by_fingerprint.setdefault(semantic_fingerprint(tag), []).append(file)
+
+	@staticmethod
+	def collisions(index):
+		return [files for files in index.values() if len(files) > 1]
+
+	def identical_dumps(self):
+		"""Groups of files with byte-identical contents"""
+		return self.collisions(self.by_content)
+
+	def shared_uids(self):
+		"""Groups of files with the same UID but different contents (identical ones are already found by identical_dumps())"""
+		return [files for files in self.collisions(self.by_uid) if len({self.hashes[file] for file in files}) > 1]
+
+	def equivalent_tags(self):
+		"""
+		Groups of files with the same filament data.  A pair of tags in the same
+		color directory is just the two tags of one spool, so only larger groups
+		and groups spread over several color directories are returned.
+		"""
+		return [files for files in self.collisions(self.by_fingerprint) if len(files) > 2 or len({color_directory(file) for file in files}) > 1]
+
+def color_directory(file):
+	# <Category>/<Material>/<Color Name>/<UUID>/-dump.bin
+	return file.parent.parent
+
+# Weight of a differing bit in each of COMPARISON_BLOCKS when looking for similar tags; unlisted blocks weigh 1.
+# The tray UID is random for every spool and production dates differ between batches, so they count for less.
+BLOCK_WEIGHTS = {9: 0.1, 12: 0.25, 13: 0.25}
+# A tag is an outlier in a field that most of its group agrees on if fewer than this fraction of the group shares its value
+OUTLIER_AGREEMENT = 0.1
+
+def bit_distances(np, blocks, query):
+	"""
+	Count the differing bits between query (a (64, 16) uint8 array) and each of
+	blocks (N, 64, 16) in every one of COMPARISON_BLOCKS, returning an (N,
+	len(COMPARISON_BLOCKS)) array.  Each block is XORed as two packed 64-bit
+	words rather than bit by bit.
+	"""
+	words = np.ascontiguousarray(blocks[:, COMPARISON_BLOCKS]).view(np.uint64)
+	query_words = np.ascontiguousarray(query[COMPARISON_BLOCKS]).view(np.uint64)
+	return np.bitwise_count(words ^ query_words).sum(axis=2, dtype=np.int32)
+
+def find_similar(batch, query, k=5):
+	"""
+	Rank the tags in a TagBatch by their weighted Hamming distance from a
+	query Tag over COMPARISON_BLOCKS.  Returns up to k (index, distance,
+	differing fields) tuples, closest first.
+	"""
+	import numpy as np
+
+	if not len(batch):
+		return []
+
+	query_blocks = np.frombuffer(bytes(query.buffer[:batch.blocks.shape[1] * batch.blocks.shape[2]]), dtype=np.uint8).reshape(batch.blocks.shape[1:])
+	weights = np.array([BLOCK_WEIGHTS.get(block, 1) for block in COMPARISON_BLOCKS], dtype=np.float64)
+	distances = bit_distances(np, batch.blocks, query_blocks) @ weights
 
+	k = min(k, len(distances))
+	closest = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(k)
+	closest = closest[np.argsort(distances[closest], kind="stable")]
+
+	fields = [field for field in FIELDS.values() if field.block in COMPARISON_BLOCKS]
+	results = []
+	for index in closest:
+		tag_bytes = batch.blocks[index].reshape(-1)
+		differing = [field.name for field in fields if not np.array_equal(tag_bytes[field.start:field.start + field.length], query_blocks.reshape(-1)[field.start:field.start + field.length])]
+		results.append((int(index), float(distances[index]), differing))
+	return results
+
+def compare_group(blocks):
+	"""
+	Compare every pair of a group of tags ((N, 64, 16) uint8 array) at once.
+	Returns a dict of:
+	- blocks: (N, N, len(COMPARISON_BLOCKS)) agreement matrix, True where both tags have the same block
+	- fields: (N, N, len(fields)) agreement matrix for the fields in COMPARISON_BLOCKS
+	- field_names: the names of those fields
+	- constant: (len(COMPARISON_BLOCKS), 16) True for bytes that are the same in every tag
+	- outliers: {tag index: [field names]} for tags whose value of a field most of the group agrees on is rare in the group
+	"""
+	import numpy as np
+
+	compared = blocks[:, COMPARISON_BLOCKS].reshape(len(blocks), -1)
+	differs = compared[:, None, :] != compared[None, :, :]
+
+	fields = [field for field in FIELDS.values() if field.block in COMPARISON_BLOCKS]
+	masks = np.zeros((compared.shape[1], len(fields)), dtype=np.int32)
+	for i, field in enumerate(fields):
+		start = COMPARISON_BLOCKS.index(field.block) * BYTES_PER_BLOCK + field.offset
+		masks[start:start + field.length, i] = 1
+	field_agreement = (differs.astype(np.int32) @ masks) == 0
+
+	outliers = {}
+	if len(blocks) > 2:
+		# How often each tag agrees with the others on each field, leaving out the diagonal
+		agreement_rate = (field_agreement.sum(axis=1) - 1) / (len(blocks) - 1)
+		usually_agree = np.median(agreement_rate, axis=0) >= 0.5
+		for index, field_indexes in enumerate(agreement_rate < OUTLIER_AGREEMENT):
+			odd = [fields[i].name for i in np.flatnonzero(field_indexes & usually_agree)]
+			if odd:
+				outliers[index] = odd
+
+	return {
+		"blocks": ~differs.reshape(len(blocks), len(blocks), len(COMPARISON_BLOCKS), BYTES_PER_BLOCK).any(axis=3),
+		"fields": field_agreement,
+		"field_names": [field.name for field in fields],
+		"constant": ~differs.any(axis=(0, 1)).reshape(len(COMPARISON_BLOCKS), BYTES_PER_BLOCK),
+		"outliers": outliers
+	}
+
+def print_group_comparison(path, filenames, comparison):
+	print(f"== {path} ({len(filenames)} tags) ==")
+	for block, constant in zip(COMPARISON_BLOCKS, comparison["constant"]):
+		print("Block {0:02d}: {1}".format(block, "".join("✅" if i else "❌" for i in constant)))
+	varying = [name for i, name in enumerate(comparison["field_names"]) if not comparison["fields"][:, :, i].all()]
+	print(f"Varying fields: {', '.join(varying) if varying else 'none'}")
+	for index, fields in comparison["outliers"].items():
+		print(f"\t[!] Outlier {filenames[index].relative_to(LIBRARY_ROOT)}: {', '.join(fields)}")
+	print()
+
+def load_library(print_error=False, debug_color=None, jobs=1, cache=None, io_threads=READ_AHEAD_THREADS, read_ahead_depth=READ_AHEAD_DEPTH, index=None):
+	library = {}
+
+	for file, tag, error in iter_checked_files(find_dumps(LIBRARY_ROOT), jobs or os.cpu_count(), cache, io_threads, read_ahead_depth):
+		if error is None:
+			# Whether a tag is a duplicate doesn't depend on its warnings
+			if index is not None:
+				index.add(file, tag)
+			try:
+				tag.check_warnings()
+			except TagDataError as e:
+				error = str(e)
+
+		if error is not None:
+			if print_error:
+				print(f'\t[!] Library load failed to parse {file.relative_to(LIBRARY_ROOT)}: {error}')
+			continue
+
+		category = tag.data['filament_type']
+		material = tag.data['detailed_filament_type']
+		color_hex = tag.data['filament_color']
 		cat_dir, mat_dir, color_dir = file.parts[-5:-2]
 
-		if (category := tag.data['filament_type']) not in library:
+		if category not in library:
 			 library.update({category:{}})
-		if (material := tag.data['detailed_filament_type']) not in library[category]:
+		if material not in library[category]:
 			 library[category].update({material:{}})
 		if (color_dir) not in library[category][material]:
 			 library[category][material].update({color_dir:[]})
-		if (color_hex := tag.data['filament_color']) not in library[category][material][color_dir]:
+		if color_hex not in library[category][material][color_dir]:
 				library[category][material][color_dir].append(color_hex)
 
 		category = CATEGORY_MAP.get(category, category)
@@ -93,16 +305,90 @@ def load_library(print_error=False, debug_color=None):
 		print("Loading done")
 	return library
 
+HEX_DIGITS = "0123456789abcdefABCDEF"
+
+def hex_color(value):
+	"""argparse type for a #RRGGBB color; the # and an alpha byte (#RRGGBBAA) are optional"""
+	digits = value[1:] if value.startswith("#") else value
+	if len(digits) not in [6, 8] or not all(digit in HEX_DIGITS for digit in digits):
+		raise argparse.ArgumentTypeError(f"{value!r} is not a #RRGGBB color")
+	return "#" + digits.upper()
+
+def positive_int(value):
+	"""argparse type for a whole number of at least 1"""
+	try:
+		number = int(value)
+	except ValueError:
+		number = 0
+	if number < 1:
+		raise argparse.ArgumentTypeError(f"{value!r} is not a positive whole number")
+	return number
+
+class LazyConsole():
+	"""A rich Console which only imports rich the first time something is printed with it"""
+
+	def __init__(self):
+		self.console = None
+
+	def print(self, *args, **kwargs):
+		if self.console is None:
+			from rich.console import Console
+			self.console = Console()
+		self.console.print(*args, **kwargs)
+
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='Check the library for tag location, parsing and color errors')
-	parser.add_argument('dir', nargs='*', default='', help='Path to library root; defaults to current directory')
+	parser.add_argument('dir', nargs='*', default='', help='Path to library root; defaults to the directory containing the scripts')
 	parser.add_argument('--color_list', '-c', action='store_true', help='Print a list of color codes found in each directory')
 	parser.add_argument('--dump_colors', '-d', action='store_true', help='While parsing the library print out the color code found in each file')
+	parser.add_argument('--duplicates', '-u', action='store_true', help='Print tags saved more than once, UIDs filed more than once, and tags with identical filament data filed in different places')
+	parser.add_argument('--similar', '-s', metavar='DUMP', help='Instead of checking the library, list the library tags most similar to a dump')
+	parser.add_argument('--top', '-k', type=positive_int, default=5, help='Number of tags listed by --similar or colors listed by --nearest')
+	parser.add_argument('--compare_groups', '-g', action='store_true', help='Instead of checking the library, compare all the tags in each color directory with each other and summarize which bytes vary')
+	parser.add_argument('--nearest', '-n', metavar='COLOR', type=hex_color, help='Instead of checking the library, list the filament colors closest to a #RRGGBB color')
+	parser.add_argument('--rebuild_index', action='store_true', help='Rebuild the color index used by --nearest even if it is up to date')
+	parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes used to parse the library; 0 uses every CPU core')
+	parser.add_argument('--no_cache', action='store_true', help='Parse every tag again instead of reusing the cache of previously parsed tags')
+	parser.add_argument('--io_threads', type=int, default=READ_AHEAD_THREADS, help='Number of threads reading files ahead of the parser when not using --jobs; 0 reads each file only when it is parsed')
+	parser.add_argument('--read_ahead', type=int, default=READ_AHEAD_DEPTH, help='Maximum number of files read ahead of the parser')
 	args = parser.parse_args()
 
-	console = Console()
-	library = load_library(True, debug_color=console if args.dump_colors else None)
+	console = LazyConsole()
+
+	if args.similar:
+		with open(args.similar, 'rb') as f:
+			query = Tag(Path(args.similar).name, f.read())
+		batch = load_batch(find_dumps(LIBRARY_ROOT), silent=True)
+		print(f'Closest library tags to {args.similar}:')
+		for rank, (index, distance, differing) in enumerate(find_similar(batch, query, args.top), 1):
+			print(f'{rank:>3}. {distance:7.2f}  {batch.filenames[index].relative_to(LIBRARY_ROOT)}')
+			print(f'\t{"differs in " + ", ".join(differing) if differing else "identical filament data"}')
+		sys.exit()
+
+	if args.nearest:
+		from color_index import load_color_index
+		color_index = load_color_index(LIBRARY_ROOT, find_dumps(LIBRARY_ROOT), rebuild=args.rebuild_index)
+		for color, path, distance in color_index.nearest(args.nearest, args.top):
+			console.print('\u2588', style=color, end=' ')
+			print(f'{color} ΔE {distance:5.1f}  {path}')
+		sys.exit()
+
+	if args.compare_groups:
+		batch = load_batch(find_dumps(LIBRARY_ROOT), silent=True)
+		groups = {}
+		for i, file in enumerate(batch.filenames):
+			groups.setdefault(color_directory(file), []).append(i)
+		for path, indexes in groups.items():
+			if len(indexes) > 1:
+				print_group_comparison(path.relative_to(LIBRARY_ROOT), [batch.filenames[i] for i in indexes], compare_group(batch.blocks[indexes]))
+		sys.exit()
+
+	cache = None if args.no_cache else TagCache()
+	index = TagIndex() if args.duplicates else None
+	library = load_library(True, debug_color=console if args.dump_colors else None, jobs=args.jobs, cache=cache, io_threads=args.io_threads, read_ahead_depth=args.read_ahead, index=index)
+	if cache:
+		cache.save()
 
 	good_colors = []
 	for category, cat_dict in library.items():
@@ -123,3 +409,15 @@ if __name__ == '__main__':
 			console.print('\u2588', style=color[0:7], end=' ')
 			console.print(f'{color} {path}')
 
+	if index:
+		for title, groups in [
+			("Found identical dumps saved more than once!", index.identical_dumps()),
+			("Found the same UID in more than one file!", index.shared_uids()),
+			("Found tags with identical filament data in more than one spool or color!", index.equivalent_tags())
+		]:
+			for files in groups:
+				console.print(title)
+				for file in files:
+					print(f'\t{file.relative_to(LIBRARY_ROOT)}')
+				console.print()
+		print(f"{len(index.by_fingerprint)} distinct tags, {len(index.by_uid)} UIDs, {len(index.by_content)} distinct dumps")
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Python script to pack the whole library of Bambu Lab RFID tag dumps into a single memory-mappable file
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+from pathlib import Path
+
+from parse import Tag, TOTAL_BYTES, RAW_FORMAT, LIBRARY_ROOT, find_dumps
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+DEFAULT_PACK_PATH = LIBRARY_ROOT / "library.pack"
+
+# File layout, all little endian:
+# - Header
+# - Lengths: one uint16 per record with the size of its dump (1024 or 1152 bytes)
+# - UID index: (UID, record number) pairs sorted by UID then record number
+# - Paths: the path of each record relative to the library root, UTF-8 encoded and separated by newlines
+# - Records: one fixed-size slot per dump, aligned to RECORD_SIZE
+MAGIC = b"BLRFPACK"
+VERSION = 1
+RECORD_SIZE = max(TOTAL_BYTES)
+HEADER = struct.Struct("<8sIIIIQQQQ") # magic, version, record count, record size, reserved, lengths/index/paths/records offsets
+INDEX_ENTRY = struct.Struct("<4sI")
+UID_LENGTH = 4
+
+class PackFormatError(ValueError):
+	pass
+
+def build_pack(root, output, silent=False):
+	"""
+	Pack every dump below root into output, returning the number of dumps
+	packed.  Dumps which aren't a valid size are left out with a warning.
+	"""
+	root = Path(root)
+	paths = []
+	records = []
+	for file in find_dumps(root):
+		data = file.read_bytes()
+		if len(data) not in TOTAL_BYTES:
+			if not silent: print(f"{file} not a valid tag, skipping")
+			continue
+		paths.append(file.relative_to(root).as_posix())
+		records.append(data)
+
+	lengths = struct.pack(f"<{len(records)}H", *(len(data) for data in records))
+	index = b"".join(INDEX_ENTRY.pack(data[:UID_LENGTH], i) for i, data in sorted(enumerate(records), key=lambda item: (item[1][:UID_LENGTH], item[0])))
+	path_table = "\n".join(paths).encode("utf-8")
+
+	lengths_offset = HEADER.size
+	index_offset = lengths_offset + len(lengths)
+	paths_offset = index_offset + len(index)
+	records_offset = -(-(paths_offset + len(path_table)) // RECORD_SIZE) * RECORD_SIZE
+
+	tmp_path = Path(output).with_name(Path(output).name + ".tmp")
+	with open(tmp_path, "wb") as f:
+		f.write(HEADER.pack(MAGIC, VERSION, len(records), RECORD_SIZE, 0, lengths_offset, index_offset, paths_offset, records_offset))
+		f.write(lengths)
+		f.write(index)
+		f.write(path_table)
+		f.write(b"\x00" * (records_offset - f.tell()))
+		for data in records:
+			f.write(data.ljust(RECORD_SIZE, b"\x00"))
+	os.replace(tmp_path, output)
+
+	return len(records)
+
+class LibraryPack():
+	"""
+	Read-only access to a pack built by build_pack().  The file is memory
+	mapped, so opening it only reads the header, lengths and paths; dumps are
+	handed to Tag as memoryviews of the map without being copied.  Tags (and
+	raw views) still in use when the pack is closed keep the map alive until
+	they're gone.
+	"""
+
+	def __init__(self, path=DEFAULT_PACK_PATH):
+		self.path = Path(path)
+		with open(self.path, "rb") as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, self.count, self.record_size, _, lengths_offset, self.index_offset, paths_offset, self.records_offset = HEADER.unpack_from(self.map)
+		if magic != MAGIC or version != VERSION:
+			self.map.close()
+			raise PackFormatError(f"{self.path} is not a version {VERSION} tag library pack")
+
+		self.view = memoryview(self.map)
+		self.lengths = self.view[lengths_offset:lengths_offset + 2 * self.count].cast("H")
+		self.paths = bytes(self.view[paths_offset:self.records_offset]).rstrip(b"\x00").decode("utf-8").split("\n") if self.count else []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		if self.map is None:
+			return
+		self.lengths.release()
+		self.view.release()
+		try:
+			self.map.close()
+		except BufferError:
+			# Tags still hold views of the map; it's unmapped once the last of them is released
+			pass
+		self.map = self.view = self.lengths = None
+
+	def __len__(self):
+		return self.count
+
+	def raw(self, index):
+		"""A zero-copy memoryview of the dump of a record"""
+		start = self.records_offset + index * self.record_size
+		return self.view[start:start + self.lengths[index]]
+
+	def tag(self, index, **kwargs):
+		"""The Tag for a record; keyword arguments are passed on to Tag"""
+		return Tag.from_bytes(self.raw(index), RAW_FORMAT, self.paths[index], **kwargs)
+
+	def __iter__(self):
+		for index in range(self.count):
+			yield self.paths[index], self.tag(index, lazy=True)
+
+	def find_uid(self, uid):
+		"""Indexes of every record with the given UID (as bytes or a hex string), via binary search of the UID index"""
+		if isinstance(uid, str):
+			uid = bytes.fromhex(uid)
+
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			if INDEX_ENTRY.unpack_from(self.map, self.index_offset + middle * INDEX_ENTRY.size)[0] < uid:
+				low = middle + 1
+			else:
+				high = middle
+
+		matches = []
+		for position in range(low, self.count):
+			entry_uid, index = INDEX_ENTRY.unpack_from(self.map, self.index_offset + position * INDEX_ENTRY.size)
+			if entry_uid != uid:
+				break
+			matches.append(index)
+		return matches
+
+def extract_pack(pack, output, silent=False):
+	"""Write every dump in a pack back out below output, at its original path"""
+	output = Path(output)
+	for index, path in enumerate(pack.paths):
+		file = output / path
+		file.parent.mkdir(parents=True, exist_ok=True)
+		file.write_bytes(pack.raw(index))
+		if not silent: print(f"  [+] Created {file}")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Pack the library into a single file, or extract or search a pack')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	build_parser = subparsers.add_parser('build', help='Pack every dump in the library')
+	build_parser.add_argument('root', nargs='?', default=LIBRARY_ROOT, help='Library root; defaults to the directory containing this script')
+	build_parser.add_argument('--output', '-o', default=DEFAULT_PACK_PATH, help='Pack file to write')
+
+	extract_parser = subparsers.add_parser('extract', help='Write the dumps in a pack back out to a directory tree')
+	extract_parser.add_argument('output', help='Directory to extract into')
+	extract_parser.add_argument('--pack', '-p', default=DEFAULT_PACK_PATH, help='Pack file to read')
+
+	find_parser = subparsers.add_parser('find', help='List the paths of dumps with the given UID(s)')
+	find_parser.add_argument('uid', nargs='+', help='Tag UID in hex')
+	find_parser.add_argument('--pack', '-p', default=DEFAULT_PACK_PATH, help='Pack file to read')
+	args = parser.parse_args()
+
+	if args.command == 'build':
+		count = build_pack(args.root, args.output)
+		print(f"Packed {count} dumps into {args.output}")
+	elif args.command == 'extract':
+		with LibraryPack(args.pack) as pack:
+			extract_pack(pack, args.output)
+	elif args.command == 'find':
+		with LibraryPack(args.pack) as pack:
+			for uid in args.uid:
+				for index in pack.find_uid(uid):
+					print(pack.paths[index])
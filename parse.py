@@ -5,15 +5,23 @@
 # Written by Vinyl Da.i'gyu-Kazotetsu (www.queengoob.org), 2024-2026
 
 import sys
-import re
-import json
 import struct
+from collections import namedtuple, deque
+from itertools import chain
+from collections.abc import Sequence, MutableMapping
 from pathlib import Path
 from datetime import datetime
 
+# Modules which only some uses of the scripts need (json, csv, numpy, argparse, concurrent.futures, multiprocessing)
+# are imported in the functions using them, so importing the scripts stays fast; benchmark.py imports checks this.
+
 if not sys.version_info >= (3, 6):
 	raise Exception("Python 3.6 or higher is required!")
 
+# The library is laid out as <Category>/<Material>/<Color Name>/<UUID>/*-dump.bin next to the scripts
+LIBRARY_ROOT = Path(__file__).resolve().parent
+DUMP_SUFFIX = "-dump.bin"
+
 COMPARISON_BLOCKS = [1, 2, 4, 5, 6, 8, 9, 10, 12, 13, 14]
 IMPORTANT_BLOCKS = [0] + COMPARISON_BLOCKS
 
@@ -52,39 +60,222 @@ def bytes_to_date(data):
 
 
 # Flipper Helper
+FLIPPER_FILETYPE = "Flipper NFC device"
+FLIPPER_HEADER = {
+	"Version": "4",
+	"Data format version": "2",
+	"Device type": "Mifare Classic",
+	"Mifare Classic type": "1K",
+}
+FLIPPER_BLOCK_PREFIX = "Block "
+FLIPPER_UNKNOWN_BYTE = "??"
+
+def parse_flipper_data(lines):
+	"""
+	Parse a Flipper NFC dump (bytes, or any iterable of lines such as a file
+	opened in text mode) in a single pass.  Returns the raw tag data and a
+	mask of the same length, which is 1 for every byte the Flipper couldn't
+	read ("??" in the dump) and 0 otherwise.  Blocks are placed by their
+	index, so they may be in any order, but every block must be present.
+	"""
+	if isinstance(lines, (bytes, bytearray, memoryview)):
+		lines = bytes(lines).decode().splitlines()
+
+	data = bytearray(BLOCKS_PER_TAG[0] * BYTES_PER_BLOCK)
+	mask = bytearray(len(data))
+	seen = bytearray(BLOCKS_PER_TAG[0])
+	header = {}
+	header_checked = False
+	prefix_length = len(FLIPPER_BLOCK_PREFIX)
+	line_number = 0
+
+	for line_number, line in enumerate(lines, 1):
+		if line.startswith(FLIPPER_BLOCK_PREFIX):
+			# The header always comes before the blocks, so make sure it's for the proper type of tag
+			if not header_checked:
+				missing = [name for name in FLIPPER_HEADER if name not in header]
+				if missing:
+					raise FlipperFormatError(line_number, f"missing header fields {missing}")
+				header_checked = True
+
+			key, separator, value = line.partition(": ")
+			try:
+				block = int(key[prefix_length:])
+				start = block * BYTES_PER_BLOCK
+				if FLIPPER_UNKNOWN_BYTE in value:
+					hex_bytes = value.split()
+					payload = bytes.fromhex(" ".join("00" if byte == FLIPPER_UNKNOWN_BYTE else byte for byte in hex_bytes))
+					mask[start:start + len(hex_bytes)] = bytes(byte == FLIPPER_UNKNOWN_BYTE for byte in hex_bytes)
+				else:
+					payload = bytes.fromhex(value)
+			except ValueError:
+				raise FlipperFormatError(line_number, f"bad block line {line.strip()!r}") from None
+			if not 0 <= block < len(seen):
+				raise FlipperFormatError(line_number, f"block {block} is out of range")
+			if len(payload) != BYTES_PER_BLOCK:
+				raise FlipperFormatError(line_number, f"block {block} has {len(payload)} bytes, expected {BYTES_PER_BLOCK}")
+
+			data[start:start + BYTES_PER_BLOCK] = payload
+			seen[block] = 1
+			continue
+
+		key, separator, value = line.strip().partition(": ")
+		if not key or key.startswith("#"):
+			continue
+		elif not separator:
+			raise FlipperFormatError(line_number, f"expected a \"Key: value\" line, got {line.strip()!r}")
+
+		elif key == "Filetype":
+			if value != FLIPPER_FILETYPE:
+				raise FlipperFormatError(line_number, f"not a Flipper NFC dump ({value})")
+
+		elif key in FLIPPER_HEADER:
+			if value != FLIPPER_HEADER[key]:
+				raise FlipperFormatError(line_number, f"unsupported {key} {value}, expected {FLIPPER_HEADER[key]}")
+			header[key] = value
+
+	if not header_checked:
+		raise FlipperFormatError(line_number, "no blocks found")
+	missing = [block for block in range(len(seen)) if not seen[block]]
+	if missing:
+		raise FlipperFormatError(line_number, f"missing blocks {missing}")
+
+	return bytes(data), bytes(mask)
+
 def strip_flipper_data(string):
-	# Remove comments
-	pattern = re.compile(r"^[\w\s]+: [\w\s\d?]+$", re.M)
-	data = dict([x.split(": ") for x in pattern.findall(string.decode())])
+	return parse_flipper_data(string)[0]
+
+# Dump formats
+# Each reader turns the contents of a dump file into the raw tag data.  Readers are tried in registration order by detect_format(), which only looks at the first few bytes; the raw format is the fallback.
+
+RAW_FORMAT = "raw"
+FORMAT_SNIFF_LENGTH = 64
+FORMAT_READERS = {}
+
+def register_reader(name, sniff=None):
+	"""
+	Decorator registering a reader for a dump format.  sniff(head) is given
+	the first FORMAT_SNIFF_LENGTH bytes of the data with leading whitespace
+	stripped, and decides whether the data is in this format.
+	"""
+	def register(read):
+		FORMAT_READERS[name] = (sniff, read)
+		return read
+	return register
+
+def detect_format(data):
+	"""Guess the format of a dump from its first bytes, without parsing it"""
+	head = bytes(data[:FORMAT_SNIFF_LENGTH]).lstrip()
+	for name, (sniff, read) in FORMAT_READERS.items():
+		if sniff is not None and sniff(head):
+			return name
+	return RAW_FORMAT
+
+@register_reader(RAW_FORMAT)
+def read_raw(data):
+	return data
+
+@register_reader("json", lambda head: head.startswith(b"{"))
+def read_json(data):
+	# Proxmark3 JSON dump
+	import json
+
+	try:
+		json_data = json.loads(bytes(data))
+	except ValueError:
+		# Not JSON after all, so treat it as a raw dump
+		return data
+	if json_data.get("Created") in ["proxmark3", "bambuman", "queengooborg/Bambu-Lab-RFID-Library/convert.py"]:
+		return b"".join([bytes.fromhex(json_data["blocks"][key].replace("??", "00")) for key in json_data["blocks"]])
+	return data
 
-	# Ensure the scan file is for the proper type of tag
-	assert(data.get("Version") == "4")
-	assert(data.get("Data format version") == "2")
-	assert(data.get("Device type") == "Mifare Classic")
-	assert(data.get("Mifare Classic type") == "1K")
+@register_reader("flipper", lambda head: head.startswith(b"Filetype: Flipper NFC"))
+def read_flipper(data):
+	# Flipper NFC dump, with the mask of bytes it couldn't read
+	return parse_flipper_data(data)
 
-	output = b""
+def decode_dump(data, format=None):
+	"""
+	Turn the contents of a dump file in any supported format (bytes,
+	bytearray, mmap or anything else supporting the buffer protocol) into
+	the raw tag data.  Raw dumps are not copied: bytes are returned as they
+	are, and anything else as a read-only memoryview of it.  If the format is
+	already known, passing it skips detection.
+	"""
+	return decode_dump_unknown(data, format)[0]
 
-	for key in data:
-		if key.startswith("Block "):
-			output += bytes.fromhex(data[key].replace("??", "00"))
+def decode_dump_unknown(data, format=None):
+	"""
+	Like decode_dump(), but returns the raw tag data and a mask of the bytes
+	which the dump marks as unknown (see parse_flipper_data()), or None if
+	the format can't mark bytes as unknown or none are.
+	"""
+	if not isinstance(data, bytes):
+		data = memoryview(data).cast("B").toreadonly()
 
-	return output
+	if format is None:
+		format = detect_format(data)
+	try:
+		read = FORMAT_READERS[format][1]
+	except KeyError:
+		raise ValueError(f"Unknown dump format {format!r}, expected one of {list(FORMAT_READERS)}") from None
+	data = read(data)
+	# Readers may also return a mask of unknown bytes
+	unknown = None
+	if isinstance(data, tuple):
+		data, unknown = data
+		if not any(unknown):
+			unknown = None
+
+	# Check to make sure the data is 1KB or a known alternative
+	if len(data) not in TOTAL_BYTES:
+		raise TagLengthMismatchError(len(data))
+
+	return data, unknown
 
 # Classes
 
 class TagDataError(TypeError):
 	def __init__(self, block, error):
 		super().__init__(f"Bad data in tag block {block}: {error}")
+		self.block = block
+		self.error = error
+
+class FlipperFormatError(TypeError):
+	def __init__(self, line, error):
+		super().__init__(f"Bad Flipper NFC dump on line {line}: {error}")
+		self.line = line
+		self.error = error
 
 class TagLengthMismatchError(TypeError):
 	def __init__(self, actual_length):
 		super().__init__(f"The data does not appear to be a valid MIFARE 1K RFID tag (received {actual_length} bytes / {int(actual_length / BYTES_PER_BLOCK)} blocks, expected {TOTAL_BYTES} bytes / {BLOCKS_PER_TAG} blocks).")
 
 class Unit():
-	def __init__(self, value, unit):
-		self.value = value
-		self.unit = unit
+	"""
+	An immutable value with a unit.  The same few values appear on thousands
+	of tags, so identical units are shared rather than created again.
+	"""
+	__slots__ = ("value", "unit")
+	_instances = {}
+
+	def __new__(cls, value, unit):
+		# repr() keeps floats like 0.0 and -0.0 apart; NaN never compares equal so it isn't shared
+		key = (cls, unit, type(value), value if type(value) is int else repr(value))
+		instance = cls._instances.get(key)
+		if instance is None:
+			instance = super().__new__(cls)
+			object.__setattr__(instance, "value", value)
+			object.__setattr__(instance, "unit", unit)
+			if value == value:
+				cls._instances[key] = instance
+		return instance
+
+	def __setattr__(self, name, value):
+		raise AttributeError("Unit is immutable")
+
+	def __reduce__(self):
+		return (type(self), (self.value, self.unit))
 
 	def __str__(self):
 		return str(self.value) + ("º" if self.unit in ["C", "F"] else "") + self.unit
@@ -99,18 +290,20 @@ class Unit():
 		return [self.value, other.value]
 
 	def __eq__(self, other):
-		values = self.__get_comparison_values(self, other)
+		values = self.__get_comparison_values(other)
 		return values[0] == values[1]
 
 	def __lt__(self, other):
-		values = self.__get_comparison_values(self, other)
+		values = self.__get_comparison_values(other)
 		return values[0] < values[1]
 
 	def __gt__(self, other):
-		values = self.__get_comparison_values(self, other)
+		values = self.__get_comparison_values(other)
 		return values[0] > values[1]
 
 class ColorList(list):
+	__slots__ = ()
+
 	def __init__(self, value):
 		if type(value) in [list, tuple]:
 			super().__init__(value)
@@ -135,130 +328,530 @@ class ColorList(list):
 		else:
 			super().extend(str(item) for item in other)
 
-class Tag():
-	def __init__(self, filename, data, fail_on_warn=False):
-		# Proxmark3 JSON dump
+# Tag layout
+
+INT_FORMATS = {1: "B", 2: "H", 4: "I"}
+FIELD_CONVERTERS = {
+	"hex": bytes_to_hex,
+	"string": bytes_to_string,
+	"date": bytes_to_date,
+}
+
+class Field():
+	"""
+	A single field in the tag layout: where it is stored (block, byte offset
+	and length) and how its bytes are decoded.  Types are "uint" and "float"
+	(little endian numbers), "hex", "string" and "date" (decoded with the
+	matching bytes_to_* function) and "bytes" (left as raw bytes).  Decoded
+	values are optionally divided by divisor, rounded to digits, passed to
+	post(value, buffer) and wrapped in a Unit.  Fields sharing a group are
+	nested under that key in Tag.data.  Fields with intern set only have a
+	handful of distinct values across the library, so equal values are
+	shared between tags.
+	"""
+
+	def __init__(self, name, block, offset, length, type, unit=None, group=None, divisor=None, digits=None, post=None, intern=False):
+		self.name = name
+		self.block = block
+		self.offset = offset
+		self.length = length
+		self.type = type
+		self.unit = unit
+		self.group = group
+		self.divisor = divisor
+		self.digits = digits
+		self.post = post
+		self.intern = intern
+
+		self.start = block * BYTES_PER_BLOCK + offset
+		self.slice = slice(offset, offset + length)
+		if type == "uint":
+			self.format = INT_FORMATS[length]
+		elif type == "float":
+			self.format = "f"
+		else:
+			self.format = f"{length}s"
+		self.struct = struct.Struct("<" + self.format)
+
+	def unpack(self, buffer, sector=0):
+		"""Read the raw value of the field; sector offsets fields that are relative to the start of a sector"""
+		return self.struct.unpack_from(buffer, self.start + sector * BLOCKS_PER_SECTOR * BYTES_PER_BLOCK)[0]
+
+	def convert(self, value, buffer):
+		"""Turn a raw value from unpack() into the value stored in Tag.data"""
+		if self.type in FIELD_CONVERTERS:
+			value = FIELD_CONVERTERS[self.type](value)
+		if self.divisor is not None:
+			value = value / self.divisor
+		if self.digits is not None:
+			value = round(value, self.digits)
+		if self.post is not None:
+			value = self.post(value, buffer)
+		if self.intern:
+			value = intern_value(value)
+		if self.unit is not None:
+			value = Unit(value, self.unit)
+		return value
+
+	def decode(self, buffer, sector=0):
+		return self.convert(self.unpack(buffer, sector), buffer)
+
+	def format_value(self, value):
+		return bytes_to_hex(value) if self.type == "bytes" else str(value)
+
+INTERNED_VALUES = {}
+
+def intern_value(value):
+	if isinstance(value, str):
+		return sys.intern(value)
+	return INTERNED_VALUES.setdefault(value, value)
+
+def shared_key_dicts():
+	"""
+	A function returning new empty dicts which, in CPython, share one table of
+	keys when they're all filled with the same keys in the same order, so each
+	only stores its values (about half the size for the decoded fields of a
+	tag).  They're the __dict__ of instances of a class made just for them,
+	but otherwise ordinary dicts.
+	"""
+	holder = type("SharedKeys", (), {})
+	return lambda: holder().__dict__
+
+class Layout():
+	"""
+	A list of fields compiled into as few struct.Struct unpackers as possible,
+	each reading several fields from the tag buffer in a single unpack_from()
+	call.  Fields are only split into another unpacker when they overlap.
+	"""
+
+	def __init__(self, fields):
+		self.fields = fields
+
+		# Top-level keys of the decoded dict, mapped to a field or the list of fields in a group
+		self.entries = {}
+		for field in fields:
+			if field.group is None:
+				self.entries[field.name] = field
+			else:
+				self.entries.setdefault(field.group, []).append(field)
+
+		# Decoded dicts always have the same keys in the same order, so each kind can share its keys
+		self.new_dict = shared_key_dicts()
+		self.new_group_dicts = {key: shared_key_dicts() for key, entry in self.entries.items() if isinstance(entry, list)}
+
+		self.unpackers = []
+		remaining = sorted(fields, key=lambda field: field.start)
+		while remaining:
+			fmt = "<"
+			pos = 0
+			names = []
+			overlapping = []
+			for field in remaining:
+				if field.start < pos:
+					overlapping.append(field)
+					continue
+				if field.start > pos:
+					fmt += f"{field.start - pos}x"
+				fmt += field.format
+				pos = field.start + field.struct.size
+				names.append(field.name)
+			self.unpackers.append((struct.Struct(fmt), names))
+			remaining = overlapping
+
+	def decode(self, buffer):
+		"""Decode every field into a dict, with grouped fields nested"""
+		raw = {}
+		for unpacker, names in self.unpackers:
+			raw.update(zip(names, unpacker.unpack_from(buffer)))
+
+		data = self.new_dict()
+		for key, entry in self.entries.items():
+			if isinstance(entry, list):
+				group = data[key] = self.new_group_dicts[key]()
+				for field in entry:
+					group[field.name] = field.convert(raw[field.name], buffer)
+			else:
+				data[key] = entry.convert(raw[key], buffer)
+		return data
+
+	def decode_key(self, key, buffer):
+		"""Decode a single top-level key (a field or a whole group)"""
+		entry = self.entries[key]
+		if isinstance(entry, list):
+			return {field.name: field.decode(buffer) for field in entry}
+		return entry.decode(buffer)
+
+def decode_filament_color_count(count, buffer):
+	has_extra_color_info = FIELDS["color_info_format"].unpack(buffer) == 2
+	return count if has_extra_color_info else 1
+
+def decode_filament_color(color, buffer):
+	color = "#" + color
+
+	# Check for a second color
+	if FIELDS["filament_color_count"].decode(buffer) == 2:
+		color += " / #" + bytes_to_hex(FIELDS["second_color"].unpack(buffer)[::-1])
+
+	return color
+
+# Fields of Tag.data, in output order
+TAG_LAYOUT = Layout([
+	Field("uid", 0, 0, 4, "hex"),
+	Field("filament_type", 2, 0, 16, "string", intern=True),
+	Field("detailed_filament_type", 4, 0, 16, "string", intern=True),
+	Field("filament_color_count", 16, 2, 2, "uint", post=decode_filament_color_count),
+	Field("filament_color", 5, 0, 4, "hex", post=decode_filament_color, intern=True),
+	Field("spool_weight", 5, 4, 2, "uint", "g"),
+	Field("filament_length", 14, 4, 2, "uint", "m"),
+	Field("filament_diameter", 5, 8, 4, "float", "mm"),
+	Field("spool_width", 10, 4, 2, "uint", "mm", divisor=100),
+	Field("material_id", 1, 8, 8, "string", intern=True),
+	Field("variant_id", 1, 0, 8, "string", intern=True),
+	Field("min_nozzle_diameter", 8, 12, 4, "float", "mm", digits=1),
+	Field("min_hotend", 6, 10, 2, "uint", "C", group="temperatures"),
+	Field("max_hotend", 6, 8, 2, "uint", "C", group="temperatures"),
+	Field("bed_temp", 6, 6, 2, "uint", "C", group="temperatures"),
+	Field("bed_temp_type", 6, 4, 2, "uint", group="temperatures"),
+	Field("drying_time", 6, 2, 2, "uint", "h", group="temperatures"),
+	Field("drying_temp", 6, 0, 2, "uint", "C", group="temperatures"),
+	Field("x_cam_info", 8, 0, 12, "bytes", intern=True),
+	Field("tray_uid", 9, 0, 16, "bytes"),
+	Field("production_date", 12, 0, 16, "date"),
+	Field("unknown_1", 13, 0, 16, "string", intern=True), # Appears to be some sort of date -- on some tags, this is identical to the production date, but not always
+	Field("unknown_2", 17, 0, 2, "bytes", intern=True), # Only been "0100" on the PLA Silk Dual Color, "0000" otherwise
+])
+
+# Fields that are not part of Tag.data
+EXTRA_FIELDS = [
+	# Manufacturer block
+	Field("sak", 0, 5, 1, "bytes"),
+	Field("atqa", 0, 6, 2, "bytes"),
+	# Dual color information
+	Field("color_info_format", 16, 0, 2, "uint"), # 2 when the block holds a color count and second color
+	Field("second_color", 16, 4, 4, "bytes"), # Stored in reverse byte order
+	# Sector trailer, relative to the start of each sector
+	Field("key_a", 3, 0, 6, "bytes"),
+	Field("access_bits", 3, 6, 4, "bytes"),
+	Field("key_b", 3, 10, 6, "bytes"),
+]
+
+FIELDS = {field.name: field for field in TAG_LAYOUT.fields + EXTRA_FIELDS}
+
+class TagData(MutableMapping):
+	"""
+	Mapping of the decoded fields of a tag, where each field is only decoded
+	the first time it is looked up.  Anything that needs the whole mapping
+	(iterating, printing, comparing, copying, modifying or pickling it)
+	decodes every remaining field first, so it behaves like the dict built by
+	an eager Tag; copies and pickles of it are plain dicts.
+	"""
+	__slots__ = ("_buffer", "_decoded")
+
+	def __init__(self, buffer):
+		self._buffer = buffer
+		self._decoded = {}
+
+	def __getitem__(self, key):
 		try:
-			json_data = json.loads(data)
-			if json_data.get("Created") in ["proxmark3", "bambuman", "queengooborg/Bambu-Lab-RFID-Library/convert.py"]:
-				data = b"".join([bytes.fromhex(json_data["blocks"][key].replace("??", "00")) for key in json_data["blocks"]])
-		except ValueError:
-			# We know that the data isn't JSON now
-			pass
-
-		# Flipper NFC dump
-		if data.startswith(b"Filetype: Flipper NFC"):
-			data = strip_flipper_data(data)
-
-		# Check to make sure the data is 1KB or a known alternative
-		if len(data) not in TOTAL_BYTES:
-			raise TagLengthMismatchError(len(data))
-
-		# Store the raw data
+			return self._decoded[key]
+		except KeyError:
+			if self._buffer is None or key not in TAG_LAYOUT.entries:
+				raise
+		value = self._decoded[key] = TAG_LAYOUT.decode_key(key, self._buffer)
+		return value
+
+	def _decode_all(self):
+		"""Every field as a dict, decoding any that haven't been yet"""
+		if self._buffer is not None:
+			decoded = TAG_LAYOUT.decode(self._buffer)
+			decoded.update(self._decoded) # Keep any fields that were already decoded
+			self._decoded = {key: decoded[key] for key in TAG_LAYOUT.entries}
+			self._buffer = None
+		return self._decoded
+
+	def __contains__(self, key):
+		return (self._buffer is not None and key in TAG_LAYOUT.entries) or key in self._decoded
+
+	def __iter__(self):
+		return iter(self._decode_all())
+
+	def __len__(self):
+		return len(self._decode_all())
+
+	def __repr__(self):
+		return repr(self._decode_all())
+
+	def __eq__(self, other):
+		if isinstance(other, TagData):
+			other = other._decode_all()
+		return self._decode_all() == other
+
+	def __or__(self, other):
+		return self._decode_all() | other
+
+	def __ror__(self, other):
+		return other | self._decode_all()
+
+	def __reduce__(self):
+		return (dict, (self.copy(),))
+
+	def copy(self):
+		return dict(self._decode_all())
+
+	def __setitem__(self, key, value):
+		self._decode_all()[key] = value
+
+	def __delitem__(self, key):
+		del self._decode_all()[key]
+
+# Validation
+
+SEVERITY_WARNING = 1
+SEVERITY_ERROR = 2
+
+BLANK_BLOCK = b'\x00' * BYTES_PER_BLOCK
+INVALID_KEYS = {b'\x00' * 6, b'\xFF' * 6}
+
+# Bytes which are expected to be blank in each block
+EXPECTED_TO_BE_BLANK = {
+	5: [*range(6,8),*range(12,16)],
+	6: range(12,16),
+	10: [*range(0,4), *range(6,16)],
+	14: [*range(0,4), *range(6,16)],
+	17: range(2,16),
+	**{block: range(0,16) for block in range(18,39) if block % 4 != 3}, # Skip MIFARE encryption key blocks
+}
+
+Issue = namedtuple("Issue", ["block", "error", "warning", "severity"])
+
+class BlankBlockRule():
+	"""Blocks which must not be entirely blank"""
+
+	def __init__(self, blocks, severity):
+		self.blocks = blocks
+		self.severity = severity
+		self.slices = [slice(block * BYTES_PER_BLOCK, (block + 1) * BYTES_PER_BLOCK) for block in blocks]
+
+	def passes(self, buffer):
+		return BLANK_BLOCK not in [buffer[s] for s in self.slices]
+
+	def issues(self, buffer):
+		for block, s in zip(self.blocks, self.slices):
+			if buffer[s] == BLANK_BLOCK:
+				yield Issue(block, 'block is blank', f"Block {block} is blank!", self.severity)
+
+class ExpectedBlankRule():
+	"""
+	Bytes which are expected to be zero.  The positions are compiled into a
+	single integer mask, so a passing tag is checked with one AND.
+	"""
+
+	def __init__(self, positions, severity):
+		self.positions = [(block, pos) for block in positions for pos in positions[block]]
+		self.severity = severity
+		self.length = (max(positions) + 1) * BYTES_PER_BLOCK
+
+		mask = bytearray(self.length)
+		for block, pos in self.positions:
+			mask[block * BYTES_PER_BLOCK + pos] = 0xFF
+		self.mask = int.from_bytes(mask, 'little')
+
+	def passes(self, buffer):
+		return int.from_bytes(buffer[:self.length], 'little') & self.mask == 0
+
+	def issues(self, buffer):
+		for block, pos in self.positions:
+			byte = buffer[block * BYTES_PER_BLOCK + pos]
+			if byte != 0:
+				yield Issue(block, f"Found {byte} at {pos} in expected blank block", f"Data found in block {block}, position {pos} that was expected to be blank (received {byte})", self.severity)
+
+class KeyRule():
+	"""
+	Every sector trailer must have both an A-key and a B-key.  All of the keys
+	in a tag are read with a single struct per tag size.
+	"""
+
+	def __init__(self, severity):
+		self.severity = severity
+		key_a = FIELDS["key_a"]
+		key_b = FIELDS["key_b"]
+		trailer = f"{key_a.start}x{key_a.format}{key_b.start - key_a.start - key_a.length}x{key_b.format}"
+		trailer += f"{BLOCKS_PER_SECTOR * BYTES_PER_BLOCK - key_b.start - key_b.length}x"
+		self.structs = {size: struct.Struct("<" + trailer * (size // (BLOCKS_PER_SECTOR * BYTES_PER_BLOCK))) for size in TOTAL_BYTES}
+
+	def passes(self, buffer):
+		return INVALID_KEYS.isdisjoint(self.structs[len(buffer)].unpack_from(buffer))
+
+	def issues(self, buffer):
+		keys = self.structs[len(buffer)].unpack_from(buffer)
+		empty_keys = ''.join('AB'[i % 2] for i, key in enumerate(keys) if key in INVALID_KEYS)
+		msg = f"Dump is missing {'+'.join(empty_keys)}"
+		yield Issue('key', msg, msg, self.severity)
+
+# Checks run on every tag, in the order their issues are reported
+VALIDATION_RULES = [
+	BlankBlockRule(IMPORTANT_BLOCKS, SEVERITY_ERROR),
+	ExpectedBlankRule(EXPECTED_TO_BE_BLANK, SEVERITY_WARNING),
+	KeyRule(SEVERITY_WARNING),
+]
+
+class BlockList(Sequence):
+	"""
+	The blocks of a tag, sliced out of its buffer when they're accessed.
+	Blocks are returned as bytes for compatibility with code expecting a list
+	of bytes, or as zero-copy memoryviews with as_bytes=False.
+	"""
+	__slots__ = ("buffer", "as_bytes")
+
+	def __init__(self, buffer, as_bytes=True):
+		self.buffer = buffer
+		self.as_bytes = as_bytes
+
+	def __len__(self):
+		return len(self.buffer) // BYTES_PER_BLOCK
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("block index out of range")
+		start = index * BYTES_PER_BLOCK
+		if self.as_bytes:
+			return bytes(self.buffer[start:start + BYTES_PER_BLOCK])
+		return memoryview(self.buffer)[start:start + BYTES_PER_BLOCK]
+
+class Tag():
+	__slots__ = ("filename", "buffer", "data", "unknown", "_issues")
+	rules = VALIDATION_RULES
+
+	def __init__(self, filename, data, fail_on_warn=False, lazy=False, format=None):
+		# The tag keeps a read-only view of data rather than a copy of it
+		data, unknown = decode_dump_unknown(data, format)
+
+		# Store the raw data, and which bytes of it weren't known (if any)
 		self.filename = filename
-		self.blocks = list(data[0+i:BYTES_PER_BLOCK+i] for i in range(0, len(data), BYTES_PER_BLOCK))
+		self.buffer = data
+		self.unknown = unknown
 
-		self.warnings = []
+		self._issues = None
 
-		# Check for blank blocks
-		for bi in IMPORTANT_BLOCKS:
-			if self.blocks[bi] == b'\x00' * BYTES_PER_BLOCK:
-				if fail_on_warn:
-					raise TagDataError(bi, 'block is blank')
-				else:
-					self.warnings.append(f"Block {bi} is blank!")
-
-		# Parse the data
-		has_extra_color_info = self.blocks[16][0:2] == b'\x02\x00'
-
-		self.data = {
-			"uid": bytes_to_hex(self.blocks[0][0:4]),
-			"filament_type": bytes_to_string(self.blocks[2]),
-			"detailed_filament_type": bytes_to_string(self.blocks[4]),
-			"filament_color_count": bytes_to_int(self.blocks[16][2:4]) if has_extra_color_info else 1,
-			"filament_color": "#" + bytes_to_hex(self.blocks[5][0:4]),
-			"spool_weight": Unit(bytes_to_int(self.blocks[5][4:6]), "g"),
-			"filament_length": Unit(bytes_to_int(self.blocks[14][4:6]), "m"),
-			"filament_diameter": Unit(bytes_to_float(self.blocks[5][8:12]), "mm"),
-			"spool_width": Unit(bytes_to_int(self.blocks[10][4:6]) / 100, "mm"),
-			"material_id": bytes_to_string(self.blocks[1][8:16]),
-			"variant_id": bytes_to_string(self.blocks[1][0:8]),
-			"min_nozzle_diameter": Unit(round(bytes_to_float(self.blocks[8][12:16]), 1), "mm"),
-			"temperatures": {
-				"min_hotend": Unit(bytes_to_int(self.blocks[6][10:12]), "C"),
-				"max_hotend": Unit(bytes_to_int(self.blocks[6][8:10]), "C"),
-				"bed_temp": Unit(bytes_to_int(self.blocks[6][6:8]), "C"),
-				"bed_temp_type": bytes_to_int(self.blocks[6][4:6]),
-				"drying_time": Unit(bytes_to_int(self.blocks[6][2:4]), "h"),
-				"drying_temp": Unit(bytes_to_int(self.blocks[6][0:2]), "C"),
-			},
-			"x_cam_info": self.blocks[8][0:12],
-			"tray_uid": self.blocks[9],
-			"production_date": bytes_to_date(self.blocks[12]),
-			"unknown_1": bytes_to_string(self.blocks[13]), # Appears to be some sort of date -- on some tags, this is identical to the production date, but not always
-			"unknown_2": self.blocks[17][0:2], # Only been "0100" on the PLA Silk Dual Color, "0000" otherwise
-		}
-
-		# Check for a second color
-		if self.data["filament_color_count"] == 2:
-			self.data["filament_color"] += " / #" + bytes_to_hex(self.blocks[16][4:8][::-1])
-
-		# Check for any data in bits that are expected to be blank
-		expected_to_be_blank = {
-			5: [*range(6,8),*range(12,16)],
-			6: range(12,16),
-			10: [*range(0,4), *range(6,16)],
-			14: [*range(0,4), *range(6,16)],
-			17: range(2,16)
-		}
-		for block in range(18,39):
-			if block % 4 == 3:
-				continue # Skip MIFARE encryption key blocks
-			expected_to_be_blank[block] = list(range(0,16))
-
-		for block in expected_to_be_blank:
-			for pos in expected_to_be_blank[block]:
-				byte = self.blocks[block][pos]
-				if byte != 0:
-					if fail_on_warn:
-						raise TagDataError(block, f"Found {byte} at {pos} in expected blank block")
-					else:
-						self.warnings.append(f"Data found in block {block}, position {pos} that was expected to be blank (received {byte})")
-
-		# Check for the presence of both A-keys and B-keys
-		empty_keys = ''
-		invalid_keys = [0, bytes_to_int(b'\xFF'*6)]
-		for block in range(0,len(self.blocks)):
-			if block % 4 == 3:
-				if bytes_to_int(self.blocks[block][0:6]) in invalid_keys:
-					empty_keys += 'A'
-				if bytes_to_int(self.blocks[block][10:16]) in invalid_keys:
-					empty_keys += 'B'
-
-		if empty_keys:
-			msg = f"Dump is missing {'+'.join(empty_keys)}"
-			if fail_on_warn:
-				raise TagDataError('key', msg)
-			else:
-				self.warnings.append(msg)
+		# Validation and decoding are deferred until first use in lazy mode
+		# fail_on_warn may also be a severity, in which case only issues at least that severe raise a TagDataError
+		if fail_on_warn or not lazy:
+			self._validate(fail_on_warn)
+
+		self.data = TagData(self.buffer) if lazy else TAG_LAYOUT.decode(self.buffer)
+
+	@classmethod
+	def from_bytes(cls, data, format=None, filename=None, **kwargs):
+		"""
+		Parse a tag from the contents of a dump file.  format names one of
+		FORMAT_READERS to skip detecting it; other keyword arguments are passed
+		on to Tag.
+		"""
+		return cls(filename, data, format=format, **kwargs)
+
+	@classmethod
+	def from_parsed(cls, filename, data, parsed, issues):
+		"""
+		Recreate a tag from its raw data and previously decoded fields and
+		issues (such as those stored by tag_cache) without parsing it again.
+		If parsed is None, fields are decoded from data as they're looked up.
+		"""
+		tag = cls.__new__(cls)
+		tag.filename = filename
+		tag.buffer = data if isinstance(data, bytes) else memoryview(data).toreadonly()
+		tag.data = TagData(tag.buffer) if parsed is None else parsed
+		tag.unknown = None # Any unknown bytes are already among the issues
+		tag._issues = tuple(Issue(*issue) for issue in issues)
+		return tag
+
+	def record(self):
+		"""The raw data and issues of the tag, which is all from_parsed() needs to recreate it"""
+		return bytes(self.buffer), self._issues
+
+	def __getstate__(self):
+		# memoryviews can't be pickled
+		return (self.filename, bytes(self.buffer), dict(self.data), self.unknown, self._issues)
+
+	def __setstate__(self, state):
+		self.filename, self.buffer, self.data, self.unknown, self._issues = state
+
+	@property
+	def blocks(self):
+		"""The blocks of the tag as bytes"""
+		return BlockList(self.buffer)
+
+	@property
+	def views(self):
+		"""The blocks of the tag as zero-copy memoryviews"""
+		return BlockList(self.buffer, as_bytes=False)
+
+	def view(self, name, sector=0):
+		"""A zero-copy memoryview of a field from FIELDS"""
+		field = FIELDS[name]
+		start = field.start + sector * BLOCKS_PER_SECTOR * BYTES_PER_BLOCK
+		return memoryview(self.buffer)[start:start + field.length]
+
+	@property
+	def issues(self):
+		if self._issues is None:
+			self._validate(False)
+		return self._issues
+
+	@property
+	def warnings(self):
+		return [issue.warning for issue in self.issues]
+
+	def _validate(self, fail_on_warn):
+		issues = []
+
+		for rule in self.rules:
+			if rule.passes(self.buffer):
+				continue
+
+			for issue in rule.issues(self.buffer):
+				if fail_on_warn and issue.severity >= fail_on_warn:
+					raise TagDataError(issue.block, issue.error)
+				issues.append(issue)
+
+		# Bytes the dump couldn't read were filled in with zeroes
+		if self.unknown is not None:
+			for block in range(len(self.unknown) // BYTES_PER_BLOCK):
+				count = self.unknown[block * BYTES_PER_BLOCK:(block + 1) * BYTES_PER_BLOCK].count(1)
+				if count:
+					issue = Issue(block, f"{count} unknown bytes", f"Block {block} has {count} byte(s) that couldn't be read!", SEVERITY_WARNING)
+					if fail_on_warn and issue.severity >= fail_on_warn:
+						raise TagDataError(issue.block, issue.error)
+					issues.append(issue)
+
+		self._issues = tuple(issues)
+
+	def check_warnings(self, fail_on_warn=True):
+		"""Raise the first issue found in the tag, as if it had been loaded with fail_on_warn"""
+		for issue in self.issues:
+			if issue.severity >= fail_on_warn:
+				raise TagDataError(issue.block, issue.error)
 
 	def __str__(self, blocks_to_output = IMPORTANT_BLOCKS):
-		result = ""
+		lines = []
 
-		for key in self.data:
-			if type(self.data[key]) == dict:
-				result += f"- {key}:\n"
-				for tkey in self.data[key]:
-					result += f"  - {tkey}: {self.data[key][tkey]}\n"
+		for key, entry in TAG_LAYOUT.entries.items():
+			if isinstance(entry, list):
+				lines.append(f"- {key}:")
+				for field in entry:
+					lines.append(f"  - {field.name}: {field.format_value(self.data[key][field.name])}")
 			else:
-				result += f"- {key}: {bytes_to_hex(self.data[key]) if type(self.data[key]) == bytes else self.data[key]}\n"
+				lines.append(f"- {key}: {entry.format_value(self.data[key])}")
 
 		if len(self.warnings):
-			result += "- Warnings:\n"
+			lines.append("- Warnings:")
 			for warning in self.warnings:
-				result += f"  - {warning}\n"
+				lines.append(f"  - {warning}")
 
-		return result[:-1]
+		return "\n".join(lines)
 
 	def print_blocks(self, blocks_to_output = IMPORTANT_BLOCKS):
 		for b in range(len(self.blocks)):
@@ -273,24 +866,249 @@ class Tag():
 		for bi in range(len(blocks_to_compare)):
 			b = blocks_to_compare[bi]
 			for i in range(BYTES_PER_BLOCK):
-				cmp_result[bi][i] = self.blocks[b][i] == other.blocks[b][i]
+				cmp_result[bi][i] = self.buffer[b * BYTES_PER_BLOCK + i] == other.buffer[b * BYTES_PER_BLOCK + i]
 
 		# Print results
 		for bi in range(len(cmp_result)):
 			print("Block {0:02d}: {1}".format(blocks_to_compare[bi], "".join("✅" if i else "❌" for i in cmp_result[bi])))
 
-def load_data(files_to_load, silent = False):
-	data = []
+# Loading
+
+READ_AHEAD_THREADS = 4
+READ_AHEAD_DEPTH = 32
+READ_AHEAD_MIN_FILES = 8 # Fewer files than this are read one at a time, as starting the threads would cost more than it saves
+
+def read_file(filename):
+	with open(filename, "rb") as f:
+		return f.read()
+
+def read_ahead(files, threads = READ_AHEAD_THREADS, depth = READ_AHEAD_DEPTH):
+	"""
+	Yield (file, contents, error) for each file in input order, reading up to
+	depth files ahead on a pool of threads so the caller can decode one file
+	while the next ones are being read.  This hides open()/read() latency on
+	network filesystems and cold caches.  error is the OSError raised reading
+	the file, if any, in which case contents is None.  With no threads, or
+	fewer than READ_AHEAD_MIN_FILES files, the files are read one at a time as
+	they are needed.
+	"""
+	files = iter(files)
+	first = []
+	for file in files:
+		first.append(file)
+		if len(first) >= READ_AHEAD_MIN_FILES:
+			break
+	files = chain(first, files)
+
+	if threads < 1 or len(first) < READ_AHEAD_MIN_FILES:
+		for file in files:
+			try:
+				yield file, read_file(file), None
+			except OSError as e:
+				yield file, None, e
+		return
+
+	from concurrent.futures import ThreadPoolExecutor
+
+	with ThreadPoolExecutor(threads) as executor:
+		pending = deque()
+		try:
+			for file in files:
+				pending.append((file, executor.submit(read_file, file)))
+				# Keep at most depth files in flight, handing the oldest back once the queue is full
+				while len(pending) >= max(depth, 1) or (pending and pending[0][1].done()):
+					yield finish_read(*pending.popleft())
+			while pending:
+				yield finish_read(*pending.popleft())
+		finally:
+			# Don't read the rest of the files if the caller stops early
+			for file, future in pending:
+				future.cancel()
+
+def finish_read(file, future):
+	try:
+		return file, future.result(), None
+	except OSError as e:
+		return file, None, e
+
+def iter_data(files_to_load, silent = False, threads = READ_AHEAD_THREADS, depth = READ_AHEAD_DEPTH, messages = None):
+	"""
+	Like load_data(), but yield each tag as soon as it's parsed while the
+	following files are read ahead.  Files which aren't valid tags are
+	reported on messages (stdout by default) unless silent.
+	"""
+	for filename, contents, error in read_ahead(files_to_load, threads, depth):
+		if error is not None:
+			raise error
+		filepath = Path(filename)
+		try:
+			yield Tag(filepath, contents)
+		except (TagLengthMismatchError, FlipperFormatError):
+			if not silent: print(f"{filepath} not a valid tag, skipping", file=messages)
+
+def load_data(files_to_load, silent = False, threads = READ_AHEAD_THREADS, depth = READ_AHEAD_DEPTH):
+	return list(iter_data(files_to_load, silent, threads, depth))
+
+# Batch decoding
+
+HEX_DIGITS = b"0123456789ABCDEF"
+NUMPY_FORMATS = {"B": "<u1", "H": "<u2", "I": "<u4", "f": "<f4"} # struct formats of numeric fields as numpy dtypes
+WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f" # Characters removed by str.strip()
+
+class TagBatch():
+	"""
+	Many tags decoded at once.  blocks is an (N, 64, 16) uint8 array of the
+	tags' first 1KB, and columns maps the name of every field in TAG_LAYOUT
+	(grouped fields are not nested) to an array of N decoded values.  Dates
+	that aren't in the usual YYYY_MM_DD_HH_MM form are NaT in their column and
+	stored in date_fallbacks as {row: value}.  row() rebuilds the equivalent
+	of Tag.data for a single tag.
+	"""
+
+	def __init__(self, filenames, blocks, columns, date_fallbacks):
+		self.filenames = filenames
+		self.blocks = blocks
+		self.columns = columns
+		self.date_fallbacks = date_fallbacks
+
+	def __len__(self):
+		return len(self.filenames)
+
+	def value(self, field, index):
+		value = self.columns[field.name][index]
+		if field.type == "bytes":
+			value = bytes(value)
+		elif field.type == "date":
+			value = self.date_fallbacks[field.name][index] if index in self.date_fallbacks[field.name] else value.item()
+		else:
+			value = value.item()
+		return Unit(value, field.unit) if field.unit is not None else value
+
+	def row(self, index):
+		data = {}
+		for key, entry in TAG_LAYOUT.entries.items():
+			if isinstance(entry, list):
+				data[key] = {field.name: self.value(field, index) for field in entry}
+			else:
+				data[key] = self.value(entry, index)
+		return data
+
+def batch_hex(np, data):
+	"""Vectorized bytes_to_hex() over the rows of a 2D uint8 array"""
+	digits = np.frombuffer(HEX_DIGITS, dtype=np.uint8)
+	width = data.shape[1] * 2
+	output = np.empty((data.shape[0], width), dtype=np.uint8)
+	output[:, 0::2] = digits[data >> 4]
+	output[:, 1::2] = digits[data & 0x0F]
+	return output.view(f"S{width}")[:, 0].astype(f"U{width}")
+
+def batch_string(np, data):
+	"""Vectorized bytes_to_string() over the rows of a 2D uint8 array"""
+	width = data.shape[1]
+	data = np.where(data == 0, ord(" "), data).astype(np.uint8)
+	strings = np.strings.strip(data.view(f"S{width}")[:, 0], WHITESPACE)
+	return strings.astype(f"U{width}")
+
+def batch_date(np, data):
+	"""
+	Vectorized bytes_to_date() over the rows of a 2D uint8 array.  Returns a
+	datetime64 column and a dict of the values for rows which don't match the
+	usual date format, decoded with bytes_to_date().
+	"""
+	digits = np.array([pos not in (4, 7, 10, 13) for pos in range(16)])
+	is_date = (data[:, 4] == ord("_")) & (data[:, 7] == ord("_")) & (data[:, 10] == ord("_")) & (data[:, 13] == ord("_"))
+	is_date &= ((data[:, digits] >= ord("0")) & (data[:, digits] <= ord("9"))).all(axis=1)
+	is_date &= (data[:, 0:4] != ord("0")).any(axis=1) # datetime can't represent year 0
+
+	iso = data.copy()
+	iso[:, [4, 7]] = ord("-")
+	iso[:, 10] = ord("T")
+	iso[:, 13] = ord(":")
+	iso[~is_date] = np.frombuffer(b"NaT".ljust(16), dtype=np.uint8)
+	dates = np.strings.strip(iso.view("S16")[:, 0]).astype("datetime64[m]")
+
+	fallbacks = {int(row): bytes_to_date(bytes(data[row])) for row in np.flatnonzero(~is_date)}
+	return dates, fallbacks
+
+def decode_batch(blocks):
+	"""Decode every field of TAG_LAYOUT for an (N, 64, 16) uint8 array of tags"""
+	import numpy as np
+
+	flat = np.ascontiguousarray(blocks).reshape(len(blocks), blocks.shape[1] * blocks.shape[2])
+	columns = {}
+	date_fallbacks = {}
+
+	def raw(field):
+		return np.ascontiguousarray(flat[:, field.start:field.start + field.length])
+
+	for field in TAG_LAYOUT.fields:
+		data = raw(field)
+		if field.type in ["uint", "float"]:
+			values = data.view(NUMPY_FORMATS[field.format])[:, 0]
+			values = values.astype(np.float64 if field.type == "float" or field.divisor else np.int64)
+		elif field.type == "hex":
+			values = batch_hex(np, data)
+		elif field.type == "string":
+			values = batch_string(np, data)
+		elif field.type == "date":
+			values, date_fallbacks[field.name] = batch_date(np, data)
+		else:
+			values = data
+
+		if field.divisor is not None:
+			values = values / field.divisor
+		if field.digits is not None:
+			values = np.round(values, field.digits)
+		columns[field.name] = values
+
+	# The vectorized equivalents of decode_filament_color_count() and decode_filament_color()
+	has_extra_color_info = raw(FIELDS["color_info_format"]).view("<u2")[:, 0] == 2
+	columns["filament_color_count"] = np.where(has_extra_color_info, columns["filament_color_count"], 1)
+	second_color = np.char.add(" / #", batch_hex(np, raw(FIELDS["second_color"])[:, ::-1]))
+	columns["filament_color"] = np.char.add(np.char.add("#", columns["filament_color"]), np.where(columns["filament_color_count"] == 2, second_color, ""))
+
+	return columns, date_fallbacks
+
+def load_batch(files_to_load, silent = False):
+	"""Load many dump files into a TagBatch, skipping any that aren't valid tags like load_data()"""
+	import numpy as np
+
+	filenames = []
+	buffers = []
 	for filename in files_to_load:
+		filepath = Path(filename)
+		with open(filepath, "rb") as f:
+			data = f.read()
 		try:
-			filepath = Path(filename)
-			with open(filepath, "rb") as f:
-				newdata = Tag(filepath, f.read())
-				data.append(newdata)
-		except TagLengthMismatchError:
+			data = decode_dump(data)
+		except (TagLengthMismatchError, FlipperFormatError):
 			if not silent: print(f"{filepath} not a valid tag, skipping")
+			continue
+		filenames.append(filepath)
+		buffers.append(data[:BLOCKS_PER_TAG[0] * BYTES_PER_BLOCK])
 
-	return data
+	blocks = np.frombuffer(b"".join(buffers), dtype=np.uint8).reshape(len(buffers), BLOCKS_PER_TAG[0], BYTES_PER_BLOCK)
+	return TagBatch(filenames, blocks, *decode_batch(blocks))
+
+def plain_value(value):
+	"""A field value as a plain JSON-friendly value: units are dropped, dates become ISO 8601 strings and bytes hex strings"""
+	if isinstance(value, Unit):
+		return value.value
+	if isinstance(value, datetime):
+		return value.isoformat()
+	if isinstance(value, (bytes, bytearray, memoryview)):
+		return bytes_to_hex(bytes(value))
+	return value
+
+def flatten_data(data):
+	"""Tag.data (or TagBatch.row()) as a flat dict of plain values, with grouped fields such as the temperatures lifted to the top level"""
+	flat = {}
+	for key, value in data.items():
+		if isinstance(value, dict):
+			flat.update(flatten_data(value))
+		else:
+			flat[key] = plain_value(value)
+	return flat
 
 def print_data(data, print_comparisons):
 	for i in range(len(data)):
@@ -303,6 +1121,72 @@ def print_data(data, print_comparisons):
 			tag.compare(data[i-1])
 			print()
 
+# Machine-readable output
+
+OUTPUT_FORMATS = ["text", "jsonl", "csv"]
+RECORD_FIELDS = ["file", *(field.name for field in TAG_LAYOUT.fields), "warnings"] # Columns of a record, in order
+
+def find_dumps(root = LIBRARY_ROOT):
+	"""Every dump of the library below root, sorted; files in root itself aren't part of the library"""
+	root = Path(root)
+	return sorted(file for file in root.rglob(f"*{DUMP_SUFFIX}") if file.parent != root)
+
+def find_files(paths, suffix = DUMP_SUFFIX):
+	"""Yield the given files, and every file ending in suffix below the given directories"""
+	for path in paths:
+		path = Path(path)
+		if path.is_dir():
+			yield from sorted(path.rglob(f"*{suffix}"))
+		else:
+			yield path
+
+def tag_record(tag):
+	"""A tag as a flat dict of plain values, with its file and warnings"""
+	return {"file": str(tag.filename), **flatten_data(tag.data), "warnings": tag.warnings}
+
+def write_jsonl(tags, output):
+	"""Write each tag as a line of JSON as soon as it's available"""
+	import json
+
+	for tag in tags:
+		output.write(json.dumps(tag_record(tag)))
+		output.write("\n")
+
+def write_csv(tags, output):
+	"""Write a header row and then each tag as a CSV row as soon as it's available, with its warnings separated by semicolons"""
+	import csv
+
+	writer = csv.DictWriter(output, RECORD_FIELDS)
+	writer.writeheader()
+	for tag in tags:
+		record = tag_record(tag)
+		record["warnings"] = "; ".join(record["warnings"])
+		writer.writerow(record)
+
 if __name__ == "__main__":
-	data = load_data(sys.argv[1:])
-	print_data(data, False)
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Parse Bambu Lab RFID tag dumps and print their contents')
+	parser.add_argument('file', nargs='*', help=f'Tag dumps to parse (raw, Proxmark JSON or Flipper NFC), or directories to parse every *{DUMP_SUFFIX} below')
+	parser.add_argument('--format', '-f', choices=OUTPUT_FORMATS, default='text', help='Print tags as text, one JSON object per line, or CSV rows')
+	parser.add_argument('--io_threads', type=int, default=READ_AHEAD_THREADS, help='Number of threads reading files ahead of the parser; 0 reads each file only when it is parsed')
+	parser.add_argument('--read_ahead', type=int, default=READ_AHEAD_DEPTH, help='Maximum number of files read ahead of the parser')
+	args = parser.parse_args()
+
+	# Print each tag as soon as it's parsed rather than after loading them all
+	# Skipped files are reported on stderr when the output is meant for other programs
+	tags = iter_data(find_files(args.file), threads=args.io_threads, depth=args.read_ahead, messages=sys.stdout if args.format == 'text' else sys.stderr)
+	try:
+		if args.format == 'jsonl':
+			write_jsonl(tags, sys.stdout)
+		elif args.format == 'csv':
+			# The csv module does its own line endings
+			sys.stdout.reconfigure(newline='')
+			write_csv(tags, sys.stdout)
+		else:
+			for tag in tags:
+				print_data([tag], False)
+		sys.stdout.flush()
+	except BrokenPipeError:
+		# The reader went away (e.g. piped into head); don't complain about it
+		sys.stdout = None
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Python script to search the library by the decoded fields of its tags
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+#
+# Queries are conditions on Tag.data fields joined with "and", for example:
+#   filament_type = PETG and max_hotend >= 260 and production_date >= 2024-06
+#   variant_id = A00-*
+# Operators are = (or ==), !=, <, <=, > and >=.  A value ending in * matches every value starting with the rest of it.
+# Values may be quoted with ' or ", for example when they contain " and ".
+# Dates may be given as YYYY, YYYY-MM, YYYY-MM-DD or YYYY-MM-DDTHH:MM, and are treated as the whole period:
+# "production_date = 2024-06" matches all of June 2024, and "production_date > 2024-06" everything from July on.
+
+import re
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from parse import FIELDS, TAG_LAYOUT, LIBRARY_ROOT, load_batch, batch_hex, flatten_data, find_dumps
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+
+# A condition's value is quoted, or runs up to the next "and"; it can't be empty or start with another operator or a stray quote.
+# Each condition must be followed by the end of the query or by "and" and another condition.
+CONDITION = re.compile(r"""\s*(\w+)\s*(>=|<=|!=|==|=|<|>)\s*('[^']*'|"[^"]*"|(?![\s<>=!'"])(?:(?!\s+and(?:\s|$)).)+?)\s*(?:$|\s+and\s+(?=\S))""", re.I)
+CONDITION_SEPARATOR = re.compile(r"\s+and\s+", re.I)
+QUERY_FIELDS = [field.name for field in TAG_LAYOUT.fields] # Fields held by a TagBatch
+NUMERIC_TYPES = ["uint", "float"]
+DATE_UNIT = "m" # Dates on tags are precise to the minute
+MAX_CHARACTER = "\U0010FFFF"
+
+class QueryError(ValueError):
+	pass
+
+def parse_query(query):
+	"""Split a query into a list of (field, operator, value) conditions"""
+	conditions = []
+	query = query.strip()
+	position = 0
+	while position < len(query) or not conditions:
+		match = CONDITION.match(query, position)
+		if not match:
+			text = CONDITION_SEPARATOR.split(query[position:], 1)[0]
+			raise QueryError(f"Can't understand the condition {text!r}; expected <field> <operator> <value>")
+		field, operator, value = match.groups()
+		if field not in QUERY_FIELDS:
+			raise QueryError(f"Unknown field {field!r}; fields which can be searched are {', '.join(QUERY_FIELDS)}")
+		if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+			value = value[1:-1]
+		conditions.append((field, "=" if operator == "==" else operator, value))
+		position = match.end()
+	return conditions
+
+def parse_date(value):
+	"""The start and end of the period a date of any supported precision covers, as numpy datetimes"""
+	try:
+		start = np.datetime64(value.replace(" ", "T"))
+	except ValueError:
+		raise QueryError(f"Can't understand the date {value!r}") from None
+	return start.astype(f"datetime64[{DATE_UNIT}]"), (start + 1).astype(f"datetime64[{DATE_UNIT}]")
+
+class QueryIndex():
+	"""
+	The tags of the library held column by column (from a TagBatch), with a
+	sorted index of each column built the first time a query needs it.  Each
+	condition is answered with a binary search of its column's sorted index,
+	so only the rows that match it are ever looked at.
+	"""
+
+	def __init__(self, batch):
+		self.batch = batch
+		self.sorted = {}
+
+	def __len__(self):
+		return len(self.batch)
+
+	def column(self, name):
+		values = self.batch.columns[name]
+		if FIELDS[name].type == "bytes":
+			values = batch_hex(np, values)
+		return values
+
+	def sorted_index(self, name):
+		"""The row numbers of a column in value order and the values in that order, leaving out dates that couldn't be parsed"""
+		if name not in self.sorted:
+			values = self.column(name)
+			order = np.argsort(values, kind="stable")
+			if FIELDS[name].type == "date":
+				order = order[~np.isnat(values[order])]
+			self.sorted[name] = (order, values[order])
+		return self.sorted[name]
+
+	def rows_between(self, name, low=None, high=None, include_low=True, include_high=True):
+		"""Row numbers (in no particular order) with low <= value <= high, or < / > without include_low / include_high"""
+		order, values = self.sorted_index(name)
+		start = 0 if low is None else np.searchsorted(values, low, "left" if include_low else "right")
+		end = len(values) if high is None else np.searchsorted(values, high, "right" if include_high else "left")
+		return order[start:max(start, end)]
+
+	def rows(self, name, operator, value):
+		"""Row numbers matching a single condition"""
+		field = FIELDS[name]
+
+		if field.type == "date":
+			start, end = parse_date(value)
+			bounds = {
+				"=": (start, end, True, False),
+				"<": (None, start, True, False),
+				"<=": (None, end, True, False),
+				">": (end, None, True, True),
+				">=": (start, None, True, True),
+			}
+		else:
+			if field.type in NUMERIC_TYPES:
+				try:
+					value = float(value)
+				except ValueError:
+					raise QueryError(f"{name} is a number, not {value!r}") from None
+			elif field.type in ["hex", "bytes"]:
+				value = value.upper()
+
+			if isinstance(value, str) and value.endswith("*") and operator in ["=", "!="]:
+				prefix = value[:-1]
+				bounds = {"=": (prefix, prefix + MAX_CHARACTER, True, False)}
+			else:
+				bounds = {
+					"=": (value, value, True, True),
+					"<": (None, value, True, False),
+					"<=": (None, value, True, True),
+					">": (value, None, False, True),
+					">=": (value, None, True, True),
+				}
+
+		if operator == "!=":
+			return np.setdiff1d(np.arange(len(self)), self.rows_between(name, *bounds["="]), assume_unique=True)
+		if operator not in bounds:
+			raise QueryError(f"{operator} can't be used with {value!r}")
+		return self.rows_between(name, *bounds[operator])
+
+	def query(self, query):
+		"""Row numbers matching every condition of a query, in library order"""
+		matches = sorted((self.rows(*condition) for condition in parse_query(query)), key=len)
+		rows = np.sort(matches[0])
+		# Start from the most selective condition so the intersections stay small
+		for other in matches[1:]:
+			if not len(rows):
+				break
+			rows = np.intersect1d(rows, other, assume_unique=True)
+		return rows
+
+def load_index(root=LIBRARY_ROOT):
+	return QueryIndex(load_batch(find_dumps(root), silent=True))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Search the library by decoded tag fields, e.g. "filament_type = PETG and max_hotend >= 260 and production_date >= 2024-06"')
+	parser.add_argument('query', help='Conditions joined with "and"; see the top of this script for the syntax')
+	parser.add_argument('--json', action='store_true', help='Print each matching tag as a line of JSON with its decoded fields instead of just its path')
+	parser.add_argument('--limit', type=int, default=None, help='Print at most this many tags')
+	parser.add_argument('--count', action='store_true', help='Only print the number of matching tags')
+	args = parser.parse_args()
+
+	index = load_index()
+	try:
+		rows = index.query(args.query)
+	except QueryError as e:
+		parser.error(str(e))
+
+	if args.count:
+		print(len(rows))
+		sys.exit()
+
+	for row in rows[:args.limit]:
+		path = index.batch.filenames[row].relative_to(LIBRARY_ROOT).as_posix()
+		if args.json:
+			print(json.dumps({"path": path, **flatten_data(index.batch.row(row))}))
+		else:
+			print(path)
@@ -3,24 +3,73 @@
 # Python script to repair any Bambu Lab RFID tag dumps without keys
 # Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
 # Written by Vinyl Da.i'gyu-Kazotetsu (www.queengoob.org), 2026
-# Requires: pycryptodome
 
+import os
 import sys
+import hmac
+import hashlib
+import argparse
+from collections import namedtuple
 from pathlib import Path
-from Crypto.Protocol.KDF import HKDF
-from Crypto.Hash import SHA256
 
-from parse import BYTES_PER_BLOCK, BLOCKS_PER_SECTOR, TOTAL_SECTORS, TOTAL_BYTES
+from parse import BYTES_PER_BLOCK, BLOCKS_PER_SECTOR, TOTAL_SECTORS, TOTAL_BYTES, DUMP_SUFFIX, find_files
 
 if not sys.version_info >= (3, 6):
   raise Exception("Python 3.6 or higher is required!")
 
 INVALID_KEYS = [b"\xFF" * 6, b"\x00" * 6]
+KEY_SUFFIX = "-key.bin"
+KEY_LENGTH = 6
+KEY_B_OFFSET = 10 # Offset of key B in a sector trailer
+MAX_LISTED = 20 # Files listed by name in a summary before the rest are only counted
+
+# Keys are derived from the UID with HKDF-SHA256 (RFC 5869), as in https://github.com/queengooborg/Bambu-Lab-RFID-Tag-Guide/blob/main/deriveKeys.py:
+# one expansion with the context "RFID-A\0" gives the 16 A keys and one with "RFID-B\0" the 16 B keys
+KDF_SALT = bytes([0x9a,0x75,0x9c,0xf2,0xc4,0xf7,0xca,0xff,0x22,0x2c,0xb9,0x76,0x9b,0x41,0xbc,0x96])
+KDF_CONTEXTS = [b"RFID-A\0", b"RFID-B\0"]
+HASH_DIGEST_SIZE = 32
+
+def hmac_key(key):
+	"""
+	An HMAC-SHA256 object for a key with no message yet.  HMACs with the key
+	copy it instead of hashing the padded key every time.
+	"""
+	return hmac.new(key, digestmod=hashlib.sha256)
+
+def hmac_sha256(key, message):
+	"""HMAC-SHA256 of a message with a key prepared by hmac_key()"""
+	mac = key.copy()
+	mac.update(message)
+	return mac.digest()
+
+KDF_SALT_KEY = hmac_key(KDF_SALT)
+
+def kdf_many(uids, key_length=KEY_LENGTH, keys_per_context=TOTAL_SECTORS):
+	"""
+	The 32 keys (16 A keys, then 16 B keys) of each UID.  The HKDF extract step
+	is shared between the A and B expansions, and the salt's HMAC state between
+	all of the UIDs.
+	"""
+	blocks = -(-key_length * keys_per_context // HASH_DIGEST_SIZE)
+	counters = [bytes([i]) for i in range(1, blocks + 1)]
+
+	results = []
+	for uid in uids:
+		prk = hmac_key(hmac_sha256(KDF_SALT_KEY, bytes(uid)))
+		keys = []
+		for context in KDF_CONTEXTS:
+			block = b""
+			output = []
+			for counter in counters:
+				block = hmac_sha256(prk, block + context + counter)
+				output.append(block)
+			output = b"".join(output)
+			keys.extend(output[i:i + key_length] for i in range(0, key_length * keys_per_context, key_length))
+		results.append(keys)
+	return results
 
-# Function copied from https://github.com/queengooborg/Bambu-Lab-RFID-Tag-Guide/blob/main/deriveKeys.py
 def kdf(uid):
-	salt = bytes([0x9a,0x75,0x9c,0xf2,0xc4,0xf7,0xca,0xff,0x22,0x2c,0xb9,0x76,0x9b,0x41,0xbc,0x96])
-	return HKDF(uid, 6, salt, SHA256, 16, context=b"RFID-A\0") + HKDF(uid, 6, salt, SHA256, 16, context=b"RFID-B\0")
+	return kdf_many([uid])[0]
 
 def sector_trailer_offset(sector):
 	block_index = sector * BLOCKS_PER_SECTOR + 3
@@ -32,51 +81,228 @@ def extract_uid(dump):
 def is_invalid_key(key):
 	return bytes(key) in INVALID_KEYS
 
-def repair_keys_in_place(path):
-	dump_bytes = path.read_bytes()
+# (sector, "A" or "B", offset in the dump) of every key, in the order of a -key.bin file: all A keys, then all B keys
+KEY_POSITIONS = [(sector, "A", sector_trailer_offset(sector)) for sector in range(TOTAL_SECTORS)]
+KEY_POSITIONS += [(sector, "B", sector_trailer_offset(sector) + KEY_B_OFFSET) for sector in range(TOTAL_SECTORS)]
+
+def dump_keys(dump):
+	"""Every key in a dump's sector trailers, in the order of KEY_POSITIONS"""
+	return [bytes(dump[offset:offset + KEY_LENGTH]) for sector, name, offset in KEY_POSITIONS]
 
-	if len(dump_bytes) not in TOTAL_BYTES:
+def key_file_path(path):
+	"""The -key.bin file next to a -dump.bin file, or None for dumps named any other way"""
+	if not path.name.endswith(DUMP_SUFFIX):
+		return None
+	return path.with_name(path.name[:-len(DUMP_SUFFIX)] + KEY_SUFFIX)
+
+def write_atomic(path, data):
+	"""Replace a file's contents all at once, so it's never left half written"""
+	tmp_path = path.with_name(path.name + ".tmp")
+	with open(tmp_path, "wb") as f:
+		f.write(data)
+	os.replace(tmp_path, path)
+
+def read_dump(path):
+	dump = path.read_bytes()
+	if len(dump) not in TOTAL_BYTES:
 		raise ValueError(f"{path} is not a 1K MIFARE Classic dump")
+	return dump
 
-	dump = bytearray(dump_bytes)
-	uid = extract_uid(dump)
-	print(f"\nFile : {path}")
-	print(f"UID  : {uid.hex()}")
+def repair_dump(dump):
+	"""
+	Fill in every missing (all 00 or FF) key of a dump with its derived key.
+	Returns the repaired dump and a list of (sector, key name, derived key) for
+	each key that was filled in; keys are only derived if something is missing.
+	"""
+	missing = [position for position in KEY_POSITIONS if is_invalid_key(dump[position[2]:position[2] + KEY_LENGTH])]
+	if not missing:
+		return dump, []
 
-	keys = kdf(uid)
+	keys = kdf(extract_uid(dump))
 	if len(keys) != 32:
 		raise ValueError("KDF did not return 32 keys")
 
-	changes = 0
+	dump = bytearray(dump)
+	repairs = []
+	for sector, name, offset in missing:
+		derived = keys[sector + (TOTAL_SECTORS if name == "B" else 0)]
+		dump[offset:offset + KEY_LENGTH] = derived
+		repairs.append((sector, name, derived))
+	return bytes(dump), repairs
 
-	for sector in range(TOTAL_SECTORS):
-		trailer = sector_trailer_offset(sector)
+def regenerate_sidecars(path, dump):
+	"""
+	Rewrite the -dump.json and .nfc files next to a dump from its contents, the
+	same way convert.py generates them.  Only files which already exist are
+	rewritten; those saved by other tools are replaced with convert.py's
+	format.  Returns the paths of the files rewritten.
+	"""
+	from parse import Tag
+	from convert import JSON_SUFFIX, NFC_SUFFIX, render_dump_json, render_flipper_nfc
 
-		key_a = dump[trailer : trailer + 6]
-		key_b = dump[trailer + 10 : trailer + 16]
+	base = path.name[:-len(DUMP_SUFFIX)]
+	tag = Tag(path.name, dump, lazy=True)
+	regenerated = []
+	for suffix, render in [(JSON_SUFFIX, render_dump_json), (NFC_SUFFIX, render_flipper_nfc)]:
+		sidecar = path.with_name(base + suffix)
+		if sidecar.exists():
+			write_atomic(sidecar, render(tag).encode())
+			regenerated.append(sidecar)
+	return regenerated
 
-		derived_a = keys[sector]
-		derived_b = keys[16 + sector]
+def repair_file(path):
+	"""
+	Repair a dump file in place, regenerating its -key.bin, -dump.json and .nfc
+	files if any keys were filled in.  Returns the list of repairs made, as
+	from repair_dump(), and the paths of the -dump.json and .nfc files which
+	were rewritten.
+	"""
+	dump, repairs = repair_dump(read_dump(path))
+	regenerated = []
+	if repairs:
+		write_atomic(path, dump)
+		key_path = key_file_path(path)
+		if key_path is not None:
+			write_atomic(key_path, b"".join(dump_keys(dump)))
+			regenerated = regenerate_sidecars(path, dump)
+	return repairs, regenerated
 
-		if is_invalid_key(key_a):
-			dump[trailer : trailer + 6] = derived_a
-			changes += 1
-			print(f"  Sector {sector:02d} Key A repaired → {derived_a.hex()}")
+def repair_keys_in_place(path):
+	"""Repair a single dump file, printing every key that was repaired"""
+	print(f"\nFile : {path}")
+	print(f"UID  : {extract_uid(read_dump(path)).hex()}")
 
-		if is_invalid_key(key_b):
-			dump[trailer + 10 : trailer + 16] = derived_b
-			changes += 1
-			print(f"  Sector {sector:02d} Key B repaired → {derived_b.hex()}")
+	repairs, regenerated = repair_file(path)
+	for sector, name, derived in repairs:
+		print(f"  Sector {sector:02d} Key {name} repaired → {derived.hex()}")
+	for sidecar in regenerated:
+		print(f"  Regenerated {sidecar.name}")
 
-	if changes:
-		path.write_bytes(dump)
-		print(f"\n{changes} key(s) repaired — file updated in place.")
+	if repairs:
+		print(f"\n{len(repairs)} key(s) repaired — file updated in place.")
 	else:
 		print("\nNo repairs needed — file left unchanged.")
 
+AuditResult = namedtuple("AuditResult", ["missing", "mismatched", "key_file"])
+
+def audit_dump(dump, key_file=None):
+	"""
+	Compare every key of a dump with the keys derived from its UID, and the
+	contents of its -key.bin (if given) with the dump's keys.  Returns the
+	(sector, key name) of keys which are missing and which differ from the
+	derived keys, and the status of the key file: None if it matches,
+	"missing" or "mismatched".
+	"""
+	derived = kdf(extract_uid(dump))
+	missing = []
+	mismatched = []
+	for (sector, name, offset), key, expected in zip(KEY_POSITIONS, dump_keys(dump), derived):
+		if is_invalid_key(key):
+			missing.append((sector, name))
+		elif key != expected:
+			mismatched.append((sector, name))
+
+	key_file_status = None
+	if key_file is not None:
+		if not key_file.exists():
+			key_file_status = "missing"
+		elif key_file.read_bytes() != b"".join(dump_keys(dump)):
+			key_file_status = "mismatched"
+
+	return AuditResult(missing, mismatched, key_file_status)
+
+def process_file(args):
+	"""Repair or audit one file for the batch modes, returning (path, result, error)"""
+	path, audit = args
+	try:
+		if audit:
+			return path, audit_dump(read_dump(path), key_file_path(path)), None
+		return path, repair_file(path), None
+	except (OSError, ValueError, TypeError) as e:
+		return path, None, str(e)
+
+def process_files(files, audit=False, jobs=1):
+	"""Yield process_file() results for each file in order, using a pool of jobs processes when there are several"""
+	tasks = [(path, audit) for path in files]
+	if jobs == 1 or len(tasks) < 2:
+		yield from map(process_file, tasks)
+		return
+
+	import multiprocessing
+
+	with multiprocessing.Pool(jobs) as pool:
+		chunk_size = max(1, min(64, len(tasks) // (jobs * 4)))
+		yield from pool.imap(process_file, tasks, chunk_size)
+
+def print_listed(heading, lines):
+	if not lines:
+		return
+	print(f"\n{heading}:")
+	for line in lines[:MAX_LISTED]:
+		print(f"  {line}")
+	if len(lines) > MAX_LISTED:
+		print(f"  ... and {len(lines) - MAX_LISTED} more")
+
+def describe_keys(keys):
+	return ", ".join(f"{sector:02d}{name}" for sector, name in keys)
+
 if __name__ == "__main__":
-	if len(sys.argv) != 2:
-		print("Usage: repair.py <dumpfile>")
-		sys.exit(1)
+	parser = argparse.ArgumentParser(description='Fill in missing sector keys of tag dumps with the keys derived from their UIDs, or audit the keys of every dump')
+	parser.add_argument('path', nargs='+', help=f'Dump files, or directories to process every *{DUMP_SUFFIX} below')
+	parser.add_argument('--audit', action='store_true', help='Check every key against the derived keys and each -key.bin against its dump, without changing anything')
+	parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes used for directories; 0 uses every CPU core')
+	args = parser.parse_args()
+
+	# A single file keeps the detailed per-key output
+	if len(args.path) == 1 and not args.audit and not Path(args.path[0]).is_dir():
+		repair_keys_in_place(Path(args.path[0]))
+		sys.exit()
+
+	files = list(find_files(args.path))
+	jobs = args.jobs or os.cpu_count()
+	errors = []
+
+	if args.audit:
+		missing = []
+		mismatched = []
+		key_files = {"missing": [], "mismatched": []}
+		for path, result, error in process_files(files, True, jobs):
+			if error is not None:
+				errors.append(error)
+				continue
+			if result.missing:
+				missing.append(f"{path}: {describe_keys(result.missing)}")
+			if result.mismatched:
+				mismatched.append(f"{path}: {describe_keys(result.mismatched)}")
+			if result.key_file is not None:
+				key_files[result.key_file].append(str(key_file_path(path)))
+
+		print_listed("[!] Keys which differ from the derived keys", mismatched)
+		print_listed("[~] Missing keys (fix with repair.py)", missing)
+		print_listed("[!] Key files which differ from their dumps", key_files["mismatched"])
+		print_listed("[~] Missing key files", key_files["missing"])
+		print_listed("[!] Errors", errors)
+
+		problems = len(mismatched) + len(missing) + len(key_files["mismatched"]) + len(key_files["missing"]) + len(errors)
+		print(f"\nAudited {len(files)} dumps: {len(mismatched)} with mismatched keys, {len(missing)} with missing keys, {len(key_files['mismatched'])} mismatched and {len(key_files['missing'])} missing key files, {len(errors)} errors")
+		sys.exit(1 if problems else 0)
+
+	repaired = 0
+	repaired_keys = 0
+	regenerated_files = 0
+	for path, result, error in process_files(files, False, jobs):
+		if error is not None:
+			errors.append(error)
+			continue
+		repairs, regenerated = result
+		if repairs:
+			repaired += 1
+			repaired_keys += len(repairs)
+			regenerated_files += len(regenerated)
+			print(f"[+] Repaired {len(repairs)} key(s) in {path}")
+			for sidecar in regenerated:
+				print(f"  [+] Regenerated {sidecar.name}")
 
-	repair_keys_in_place(Path(sys.argv[1]))
+	print_listed("[!] Errors", errors)
+	print(f"\nRepaired {repaired_keys} keys in {repaired} of {len(files)} dumps, regenerated {regenerated_files} JSON and Flipper files, {len(errors)} errors")
+	sys.exit(1 if errors else 0)
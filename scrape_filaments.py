@@ -8,9 +8,6 @@ import sys
 import re
 import urllib.parse
 from pathlib import Path
-from prettytable import PrettyTable, TableStyle
-
-import requests
 
 if not sys.version_info >= (3, 6):
   raise Exception("Python 3.6 or higher is required!")
@@ -120,6 +117,9 @@ def get_category(material):
 	raise Exception(f"Category for {material} is not specified!")
 
 def get_materials():
+	# Third-party modules are imported where they're used, so they're only loaded when needed
+	import requests
+
 	req = requests.get(JSON_URL)
 	filament_data = req.json().get('data')
 
@@ -175,6 +175,8 @@ def make_table(category, material, colors, existing_data):
 	folder = FOLDER_NAME_OVERRIDES.get(material, material)
 	out = f"#### {make_md_link(material, f'./{category}/{folder}')}\n\n"
 
+	from prettytable import PrettyTable, TableStyle
+
 	table = PrettyTable()
 	table.set_style(TableStyle.MARKDOWN)
 	table.align = "l"
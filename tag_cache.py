@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Persistent cache of parsed Bambu Lab RFID tags, so repeated runs over the library only need to stat() each file
+# Created for https://github.com/queengooborg/Bambu-Lab-RFID-Library
+
+import os
+import sys
+import pickle
+import hashlib
+from pathlib import Path
+
+from parse import Tag
+
+if not sys.version_info >= (3, 6):
+	raise Exception("Python 3.6 or higher is required!")
+
+CACHE_VERSION = 5
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent / ".tag_cache"
+
+class TagCache():
+	"""
+	Maps each file (by absolute path) to its size, modification time, raw tag
+	data and issues (Tag.record()); the fields of cached tags are decoded from
+	the raw data as they're looked up.  An entry is only reused while the size
+	and mtime still match the file on disk; with hash_contents the file is
+	also read and compared against a stored BLAKE2 digest, which guards
+	against edits that preserve both.
+
+	Tags are always cached as parsed without fail_on_warn; strict callers get
+	the same TagDataError from Tag.check_warnings() that a fresh parse would
+	have raised.
+	"""
+
+	def __init__(self, path=DEFAULT_CACHE_PATH, hash_contents=False):
+		self.path = Path(path)
+		self.hash_contents = hash_contents
+		self.entries = {}
+		self.seen = set()
+		self.dirty = False
+
+		try:
+			with open(self.path, "rb") as f:
+				version, entries = pickle.load(f)
+			if version == CACHE_VERSION:
+				self.entries = entries
+		except FileNotFoundError:
+			pass
+		except Exception:
+			# Corrupt or incompatible cache, start from scratch
+			self.dirty = True
+
+	def get(self, path, filename=None):
+		"""Return the cached tag for path if it is still up to date, otherwise None"""
+		key = os.path.abspath(path)
+		self.seen.add(key)
+
+		entry = self.entries.get(key)
+		if entry is None:
+			return None
+
+		size, mtime, digest, data, issues = entry
+		try:
+			st = os.stat(key)
+		except FileNotFoundError:
+			del self.entries[key]
+			self.dirty = True
+			return None
+		if st.st_size != size or st.st_mtime_ns != mtime:
+			return None
+		if self.hash_contents and digest != file_digest(key):
+			return None
+
+		return Tag.from_parsed(Path(path).name if filename is None else filename, data, None, issues)
+
+	def put(self, path, tag):
+		"""Store a tag that was parsed (without fail_on_warn) from path"""
+		key = os.path.abspath(path)
+		st = os.stat(key)
+		digest = file_digest(key) if self.hash_contents else None
+		self.entries[key] = (st.st_size, st.st_mtime_ns, digest, *tag.record())
+		self.seen.add(key)
+		self.dirty = True
+
+	def load(self, path, filename=None):
+		"""Return the tag for path, parsing and caching it if needed"""
+		tag = self.get(path, filename)
+		if tag is None:
+			with open(path, "rb") as f:
+				tag = Tag(Path(path).name if filename is None else filename, f.read())
+			self.put(path, tag)
+		return tag
+
+	def save(self):
+		"""Evict entries for deleted files and write the cache back to disk if anything changed"""
+		for key in [key for key in self.entries if key not in self.seen and not os.path.exists(key)]:
+			del self.entries[key]
+			self.dirty = True
+
+		if not self.dirty:
+			return
+
+		tmp_path = self.path.with_name(self.path.name + ".tmp")
+		with open(tmp_path, "wb") as f:
+			pickle.dump((CACHE_VERSION, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, self.path)
+		self.dirty = False
+
+def file_digest(path):
+	with open(path, "rb") as f:
+		return hashlib.blake2b(f.read(), digest_size=16).digest()